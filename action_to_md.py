@@ -18,18 +18,32 @@ converts it to a human-readable markdown document, similar to terraform-docs.
 
 import sys
 import json
-import yaml
+import time
+import difflib
+import hashlib
+import unicodedata
 import click
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from pathlib import Path
-import pytablewriter as ptw
+
+# yaml, pytablewriter and concurrent.futures are imported where they're used, as
+# importing them dominates the start-up time of a single-file run
+
+from replace_between import replace_section, write_if_changed
+
+# Records what each README was generated from, so `--all` can skip unchanged actions
+MANIFEST_FILE = ".docs-manifest.json"
 
 
 def load_yaml_file(file_path: Path) -> Dict[str, Any]:
     """Load and parse a YAML file."""
+    import yaml
+
+    # The C loader (libyaml) is much faster, when PyYAML has been built with it
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
     try:
         with open(file_path, "r") as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=loader)
     except Exception as e:
         print(f"Error loading YAML file: {e}", file=sys.stderr)
         sys.exit(1)
@@ -78,6 +92,68 @@ def is_required(input_config: Dict[str, Any]) -> str:
     return "no"
 
 
+def unquote_cell(value: str) -> str:
+    """Strip one pair of surrounding quotes, like pytablewriter does."""
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"" and value[0] not in value[1:-1]:
+        return value[1:-1]
+    return value
+
+
+def is_typed_cell(value: str) -> bool:
+    """Whether pytablewriter would format a cell as something other than plain text.
+
+    This covers values it parses as numbers or booleans, and characters whose display
+    width it calculates in ways the built-in renderer doesn't.
+    """
+    value = unquote_cell(value)
+    stripped = value.strip()
+    if stripped.lower() in ("true", "false"):
+        return True
+    try:
+        # pytablewriter ignores underscores and thousands separators in numbers
+        float(stripped.replace("_", "").replace(",", ""))
+        return True
+    except ValueError:
+        pass
+    return any(
+        unicodedata.category(char)[0] in "CZ" and char not in " \n\t" for char in value
+    )
+
+
+def cell_width(value: str) -> int:
+    """Display width of a cell, as pytablewriter counts it: wide East Asian characters take two columns."""
+    return sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in value)
+
+
+def generate_table(headers: List[str], rows: List[List[str]]) -> str:
+    """Render a markdown table, formatted exactly like pytablewriter's MarkdownTableWriter.
+
+    Cells are left-aligned and headers centered. Like pytablewriter, surrounding quotes are
+    stripped, line breaks become spaces and tabs two spaces, and pipes are escaped after the
+    column widths are measured. Tables with number or boolean cells are left to pytablewriter.
+    """
+    if any(is_typed_cell(cell) for row in rows for cell in row):
+        import pytablewriter as ptw
+
+        return ptw.MarkdownTableWriter(headers=headers, value_matrix=rows).dumps()
+
+    cells = [[unquote_cell(cell).replace("\r\n", " ").replace("\n", " ").replace("\t", "  ") for cell in row] for row in rows]
+    widths = [max([3, cell_width(header)] + [cell_width(row[i]) for row in cells]) for i, header in enumerate(headers)]
+
+    def line(values: List[str]) -> str:
+        return "|" + "|".join(values) + "|\n"
+
+    header_cells = []
+    for header, width in zip(headers, widths):
+        padding = width - cell_width(header)
+        header_cells.append(" " * (padding // 2) + header + " " * (padding - padding // 2))
+
+    table = line(header_cells) + line(["-" * width for width in widths])
+    for row in cells:
+        table += line([cell.replace("|", "\\|") + " " * (width - cell_width(cell)) for cell, width in zip(row, widths)])
+    return table
+
+
 def generate_metadata_section(config: Dict[str, Any]) -> str:
     """Generate the metadata section with action name, description, and author."""
     markdown = ""
@@ -94,7 +170,7 @@ def generate_metadata_section(config: Dict[str, Any]) -> str:
 
 
 def generate_inputs_table(inputs: Dict[str, Any]) -> str:
-    """Generate a markdown table for action inputs using pytablewriter."""
+    """Generate a markdown table for action inputs."""
     if not inputs:
         return "No inputs defined."
 
@@ -122,19 +198,11 @@ def generate_inputs_table(inputs: Dict[str, Any]) -> str:
             [formatted_name, description, required, f"``{default}``"]
         )
 
-    # Create the table writer
-    writer = ptw.MarkdownTableWriter(
-        headers=headers,
-        value_matrix=rows,
-        align_list=["left", "left", "center", "left"],
-    )
-
-    # Get the table as a string
-    return writer.dumps()
+    return generate_table(headers, rows)
 
 
 def generate_outputs_table(outputs: Dict[str, Any]) -> str:
-    """Generate a markdown table for action outputs using pytablewriter."""
+    """Generate a markdown table for action outputs."""
     if not outputs:
         return "No outputs defined."
 
@@ -160,15 +228,7 @@ def generate_outputs_table(outputs: Dict[str, Any]) -> str:
             [formatted_name, description, f"``{value}``"]
         )
 
-    # Create the table writer
-    writer = ptw.MarkdownTableWriter(
-        headers=headers,
-        value_matrix=rows,
-        align_list=["left", "left", "left"],
-    )
-
-    # Get the table as a string
-    return writer.dumps()
+    return generate_table(headers, rows)
 
 
 def generate_usage_example(config: Dict[str, Any], config_file: Path) -> str:
@@ -205,12 +265,7 @@ def generate_usage_example(config: Dict[str, Any], config_file: Path) -> str:
 
             rows.append([f"`{input_name}`", description, required, f"``{default}``"])
 
-        writer = ptw.MarkdownTableWriter(
-            headers=headers,
-            value_matrix=rows,
-            align_list=["left", "left", "center", "left"],
-        )
-        markdown += writer.dumps()
+        markdown += generate_table(headers, rows)
         markdown += "\n"
 
     # Add the usage example code block
@@ -268,26 +323,205 @@ def generate_markdown(config: Dict[str, Any], config_file: Path) -> str:
     return markdown
 
 
+def render(config_file: Path, ref: str) -> str:
+    """Render the markdown documentation for an action.yml file."""
+    config = load_yaml_file(config_file)
+
+    # Store the ref in config for use in generate_usage_example
+    config["__ref"] = ref
+
+    return generate_markdown(config, config_file)
+
+
+def find_action_files(root: Path) -> List[Path]:
+    """Find every action.yml under root that has a README.md next to it."""
+    action_files = []
+    for config_file in sorted(root.rglob("action.yml")):
+        if (config_file.parent / "README.md").is_file():
+            action_files.append(config_file)
+        else:
+            print(f"Skipping {config_file}: no README.md", file=sys.stderr)
+    return action_files
+
+
+def input_hash(config_file: Path, ref: str) -> str:
+    """Hash everything the generated README section depends on."""
+    digest = hashlib.sha256()
+    # The generator's own source stands in for its version
+    for source in (Path(__file__), Path(__file__).with_name("replace_between.py")):
+        digest.update(source.read_bytes())
+    digest.update(ref.encode() + b"\0")
+    digest.update(config_file.read_bytes())
+    return digest.hexdigest()
+
+
+def render_readme(config_file: Path, ref: str, section: str = "BOILERPLATE") -> Tuple[Path, str, str]:
+    """Render an action.yml into the section between markers in the README.md next to it.
+
+    Returns the README path, its current content and its content with the section updated.
+    """
+    # A trailing newline, like the output of `action_to_md.py file | replace_between.py`
+    markdown_content = render(config_file, ref) + "\n"
+    readme = config_file.parent / "README.md"
+    current = readme.read_text()
+    content, _ = replace_section(
+        current,
+        markdown_content,
+        f"<!-- {section} BEGIN -->",
+        f"<!-- {section} END -->",
+        create=True,
+    )
+    return readme, current, content
+
+
+def update_readme(config_file: Path, ref: str) -> Tuple[Path, float, str]:
+    """Update the README.md next to an action.yml.
+
+    Returns the README path, the time taken in seconds and the hash of the README.
+    """
+    start = time.perf_counter()
+    readme, current, content = render_readme(config_file, ref)
+    if content != current:
+        write_if_changed(readme, content)
+    return readme, time.perf_counter() - start, hashlib.sha256(content.encode()).hexdigest()
+
+
+def check_readme(config_file: Path, ref: str) -> str:
+    """Return a diff between the README.md next to an action.yml and what it should be."""
+    readme, current, content = render_readme(config_file, ref)
+    return "".join(
+        difflib.unified_diff(
+            current.splitlines(keepends=True),
+            content.splitlines(keepends=True),
+            f"{readme} (current)",
+            f"{readme} (generated)",
+        )
+    )
+
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, str]]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def update_all_readmes(
+    root: Path, ref: str, jobs: Optional[int] = None, manifest_path: Optional[Path] = None, force: bool = False
+) -> List[Tuple[Path, Optional[float]]]:
+    """Update the README.md of every action under root, in a process pool.
+
+    With a manifest, actions whose action.yml, --ref and generator are unchanged since
+    the last run, and whose README hasn't been modified since, are skipped. Returns the
+    README paths and the time each took, or None for skipped READMEs. With force, every
+    README is updated, but the manifest is still written. Manifest entries for actions
+    that no longer exist are dropped.
+    """
+    action_files = find_action_files(root)
+    keys = [str(config_file.relative_to(root)) for config_file in action_files]
+    manifest = load_manifest(manifest_path) if manifest_path else {}
+    manifest = {key: entry for key, entry in manifest.items() if key in keys}
+    results: List[Tuple[Path, Optional[float]]] = []
+    changed = []
+    for key, config_file in zip(keys, action_files):
+        readme = config_file.parent / "README.md"
+        entry = {"input": input_hash(config_file, ref), "readme": hashlib.sha256(readme.read_bytes()).hexdigest()}
+        if not force and manifest.get(key) == entry:
+            results.append((readme, None))
+        else:
+            changed.append((key, config_file, entry["input"]))
+
+    if changed:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            updates = executor.map(update_readme, [c for _, c, _ in changed], [ref] * len(changed))
+            for (key, _, input_digest), (readme, seconds, readme_digest) in zip(changed, updates):
+                manifest[key] = {"input": input_digest, "readme": readme_digest}
+                results.append((readme, seconds))
+
+    if manifest_path:
+        manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    return sorted(results)
+
+
+def check_all_readmes(root: Path, ref: str, jobs: Optional[int] = None) -> List[str]:
+    """Return diffs for the README.md of every action under root that isn't up to date."""
+    action_files = find_action_files(root)
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return [diff for diff in executor.map(check_readme, action_files, [ref] * len(action_files)) if diff]
+
+
 @click.command()
 @click.argument(
     "config_file",
     type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),
+    required=False,
 )
 @click.option(
     "--ref",
     default="main",
     help="Git ref to use in the usage example (e.g., 'main', 'v1', 'master')",
 )
-def main(config_file: Path, ref: str):
+@click.option(
+    "--all",
+    "root",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),
+    help="Update the README.md of every action.yml under this directory, instead of printing one",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=None,
+    help="Number of worker processes for --all (default: number of CPUs)",
+)
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Don't write anything. Print a diff and exit non-zero if the README.md is out of date",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help=f"With --all, update every README.md, even if the {MANIFEST_FILE} manifest says it's up to date",
+)
+def main(
+    config_file: Optional[Path], ref: str, root: Optional[Path], jobs: Optional[int], check: bool, force: bool
+):
     """Generate documentation from a GitHub Actions action.yml file."""
-    # Load and parse the config file
-    config = load_yaml_file(config_file)
-
-    # Store the ref in config for use in generate_usage_example
-    config["__ref"] = ref
+    if root is not None and config_file is not None:
+        raise click.UsageError("CONFIG_FILE can't be used with --all")
+    if root is None and config_file is None:
+        raise click.UsageError("Missing argument 'CONFIG_FILE' (or --all)")
+
+    if check:
+        diffs = check_all_readmes(root, ref, jobs) if root is not None else [check_readme(config_file, ref)]
+        diffs = [diff for diff in diffs if diff]
+        for diff in diffs:
+            print(diff)
+        if diffs:
+            print(f"{len(diffs)} README(s) are out of date. Run `make docs` to update them.", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if root is not None:
+        start = time.perf_counter()
+        results = update_all_readmes(root, ref, jobs, root / MANIFEST_FILE, force)
+        for readme, seconds in results:
+            timing = "unchanged" if seconds is None else f"{seconds * 1000:.1f} ms"
+            print(f"{timing:>12}  {readme}", file=sys.stderr)
+        updated = sum(seconds is not None for _, seconds in results)
+        print(
+            f"Updated {updated} of {len(results)} READMEs in {time.perf_counter() - start:.2f}s",
+            file=sys.stderr,
+        )
+        return
 
     # Generate markdown
-    markdown_content = generate_markdown(config, config_file)
+    markdown_content = render(config_file, ref)
 
     # Print to stdout for redirection
     print(markdown_content)
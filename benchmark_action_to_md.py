@@ -0,0 +1,76 @@
+#!/usr/bin/env -S uv run --script
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "click",
+#     "pyyaml",
+#     "pytablewriter",
+# ]
+# ///
+
+"""
+Benchmark the start-up cost of a single action_to_md.py run.
+
+Times `action_to_md.py <action.yml>` in fresh interpreters, next to an empty interpreter
+for reference. With --compare-ref, the action_to_md.py from that git revision is timed
+as well, to show the saving per invocation.
+
+Usage:
+  ./benchmark_action_to_md.py terraform-deploy/action.yml --runs 20
+  ./benchmark_action_to_md.py terraform-deploy/action.yml --compare-ref main
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+
+
+def time_command(command: list[str], runs: int) -> float:
+    """Return the median wall time of running command, in seconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def checkout_scripts(ref: str, directory: Path) -> Path:
+    """Write action_to_md.py (and replace_between.py, which it may import) from ref into directory."""
+    for name in ("action_to_md.py", "replace_between.py"):
+        source = subprocess.run(["git", "show", f"{ref}:{name}"], cwd=ROOT, capture_output=True, text=True)
+        if source.returncode == 0:
+            (directory / name).write_text(source.stdout)
+    return directory / "action_to_md.py"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the start-up cost of action_to_md.py")
+    parser.add_argument("config_file", type=Path, help="action.yml to render")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs per command (median is kept)")
+    parser.add_argument("--compare-ref", help="Also time action_to_md.py from this git revision")
+    args = parser.parse_args()
+
+    commands = {
+        "python (empty)": [sys.executable, "-c", "pass"],
+        "action_to_md.py": [sys.executable, str(ROOT / "action_to_md.py"), str(args.config_file)],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.compare_ref:
+            script = checkout_scripts(args.compare_ref, Path(tmp))
+            commands[f"action_to_md.py @ {args.compare_ref}"] = [sys.executable, str(script), str(args.config_file)]
+
+        results = {name: time_command(command, args.runs) for name, command in commands.items()}
+
+    for name, seconds in results.items():
+        print(f"{name:<40} {seconds * 1000:8.1f} ms")
+    if args.compare_ref:
+        saved = results[f"action_to_md.py @ {args.compare_ref}"] - results["action_to_md.py"]
+        print(f"\nSaved per invocation: {saved * 1000:.1f} ms")
@@ -1,14 +1,132 @@
 #!/usr/bin/env -S uv run --script
 # /// script
 # requires-python = ">=3.12"
+# dependencies = [
+#     # renovate: datasource=pypi depName=jsonschema
+#     "jsonschema==4.26.0",
+#     # Imported directly for the schema registry, so pinned as well
+#     # renovate: datasource=pypi depName=referencing
+#     "referencing==0.37.0",
+# ]
 # ///
-"""Build a GP CI/CD config file with computed values (stackDir, concurrencyGroup, appName)."""
+"""Build a GP CI/CD config file with computed values (stackDir, concurrencyGroup, appName).
+
+The config is validated against the schema in its `$schema` key first. Remote schemas
+are cached on disk, keyed by URL, and only used from the cache if their content still
+matches the recorded hash. Each schema is compiled to a validator once per process.
+"""
 
 import argparse
+import hashlib
 import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import jsonschema
+from referencing import Registry, Resource
+from referencing.exceptions import Unresolvable
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "build-gp-config" / "schemas"
+# Remote schemas are refetched when the cached copy is older than this
+DEFAULT_CACHE_MAX_AGE = 24 * 60 * 60
+
+
+class SchemaLoadError(Exception):
+    """A schema couldn't be read or fetched."""
+
+
+class SchemaCache:
+    """Loads schemas from local paths or URLs, caching remote schemas on disk.
+
+    A cache entry is a pair of files named after the SHA-256 of the URL: the schema
+    itself, and a small index recording the URL and the SHA-256 of the content. Entries
+    that are stale, or whose content doesn't match its hash, are fetched again.
+    """
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_age: float = DEFAULT_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.validators: dict[str, jsonschema.protocols.Validator] = {}
+        self.registry = Registry(retrieve=self.retrieve)
+
+    def load(self, ref: str) -> tuple[bytes, str]:
+        """Return the content of a schema and its SHA-256. Raises SchemaLoadError if it can't be loaded."""
+        if not ref.startswith(("http://", "https://")):
+            try:
+                content = Path(ref).read_bytes()
+            except OSError as e:
+                raise SchemaLoadError(f"Could not read schema {ref}: {e.strerror or e}") from e
+            return content, hashlib.sha256(content).hexdigest()
+
+        key = hashlib.sha256(ref.encode()).hexdigest()
+        index_path = self.cache_dir / f"{key}.index.json"
+        content_path = self.cache_dir / f"{key}.json"
+        try:
+            index = json.loads(index_path.read_text())
+            content = content_path.read_bytes()
+            digest = hashlib.sha256(content).hexdigest()
+            if index["url"] == ref and index["sha256"] == digest and time.time() - index["fetched"] < self.max_age:
+                return content, digest
+        except (OSError, ValueError, KeyError):
+            pass
+
+        try:
+            with urllib.request.urlopen(ref, timeout=30) as response:
+                content = response.read()
+        except (urllib.error.URLError, TimeoutError) as e:
+            raise SchemaLoadError(f"Could not fetch schema {ref}: {getattr(e, 'reason', e)}") from e
+        digest = hashlib.sha256(content).hexdigest()
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write the content before the index, so a partial write is never trusted
+            content_path.write_bytes(content)
+            index_path.write_text(json.dumps({"url": ref, "sha256": digest, "fetched": time.time()}))
+        except OSError as e:
+            print(f"Warning: could not cache schema {ref}: {e}", file=sys.stderr)
+        return content, digest
+
+    def retrieve(self, uri: str) -> Resource:
+        """Resolve a remote `$ref` in a schema through the same cache."""
+        content, _ = self.load(uri)
+        return Resource.from_contents(json.loads(content))
+
+    def validator(self, ref: str) -> jsonschema.protocols.Validator:
+        """Return a compiled validator for the schema, reusing it if the content is unchanged."""
+        content, digest = self.load(ref)
+        if digest not in self.validators:
+            schema = json.loads(content)
+            cls = jsonschema.validators.validator_for(schema)
+            cls.check_schema(schema)
+            self.validators[digest] = cls(schema, registry=self.registry, format_checker=cls.FORMAT_CHECKER)
+        return self.validators[digest]
+
+
+def validate_config(config: dict, config_file: str, schemas: SchemaCache, schema_file: str = "") -> list[str]:
+    """Validate the config against schema_file, or its `$schema`. Returns a list of errors."""
+    ref = schema_file or config.get("$schema", "")
+    if not ref:
+        return [f"Config file {config_file} is not using any schema."]
+    try:
+        validator = schemas.validator(ref)
+        errors = sorted(validator.iter_errors(config), key=lambda e: list(e.absolute_path))
+    except SchemaLoadError as e:
+        return [str(e)]
+    except Unresolvable as e:
+        # A `$ref` that couldn't be loaded, wrapped by referencing and jsonschema
+        cause = e
+        while cause is not None and not isinstance(cause, SchemaLoadError):
+            cause = cause.__cause__
+        return [str(cause or f"Could not resolve schema reference {e.ref}")]
+    return [f"{config_file}::{error.json_path}: {error.message}" for error in errors]
 
 
 def build_config(config: dict, app_name: str, stack_name: str) -> dict:
+    """Return a copy of config with the computed values added. config isn't modified."""
+    config = dict(config)
     if app_name:
         config["appName"] = app_name
 
@@ -16,6 +134,7 @@ def build_config(config: dict, app_name: str, stack_name: str) -> dict:
         if env not in config:
             continue
 
+        config[env] = dict(config[env])
         if stack_name:
             config[env]["stackDir"] = f"{config[env]['infrastructureRoot']}/{stack_name}"
 
@@ -27,17 +146,71 @@ def build_config(config: dict, app_name: str, stack_name: str) -> dict:
     return config
 
 
+def parse_targets(raw: str) -> list[dict[str, str]]:
+    """Parse a JSON array of {"app-name": ..., "stack-name": ...} objects. Both keys are optional."""
+    targets = json.loads(raw)
+    if not isinstance(targets, list):
+        raise ValueError("matrix targets must be a JSON array")
+    for target in targets:
+        if not isinstance(target, dict) or not set(target) <= {"app-name", "stack-name"}:
+            raise ValueError(f'matrix target must be an object with "app-name" and/or "stack-name": {target!r}')
+        if not all(isinstance(value, str) for value in target.values()):
+            raise ValueError(f"matrix target values must be strings: {target!r}")
+    return targets
+
+
+def build_matrix(config: dict, targets: list[dict[str, str]]) -> dict:
+    """Build the config for each target, as a GitHub Actions matrix (`{"include": [...]}`).
+
+    Each entry has the target's app-name and stack-name, and the built config.
+    """
+    include = []
+    for target in targets:
+        app_name = target.get("app-name", "")
+        stack_name = target.get("stack-name", "")
+        include.append(
+            {"app-name": app_name, "stack-name": stack_name, "config": build_config(config, app_name, stack_name)}
+        )
+    return {"include": include}
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--config-file", required=True)
     parser.add_argument("--app-name", default="")
     parser.add_argument("--stack-name", default="")
+    parser.add_argument(
+        "--matrix",
+        default="",
+        help='JSON array of {"app-name": ..., "stack-name": ...} objects. Builds a config for each, as a GitHub Actions matrix',
+    )
+    parser.add_argument("--schema-file", default="", help="Validate against this schema instead of the config's $schema")
+    parser.add_argument("--schema-cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help="Directory to cache remote schemas in")
     args = parser.parse_args()
 
-    with open(args.config_file) as f:
-        config = json.load(f)
+    targets = []
+    if args.matrix:
+        try:
+            targets = parse_targets(args.matrix)
+        except ValueError as e:
+            parser.error(str(e))
+
+    try:
+        with open(args.config_file) as f:
+            config = json.load(f)
+    except OSError as e:
+        print(f"::error::Could not read config file {args.config_file}: {e.strerror or e}", file=sys.stderr)
+        sys.exit(1)
+
+    if errors := validate_config(config, args.config_file, SchemaCache(args.schema_cache_dir), args.schema_file):
+        for error in errors:
+            print(f"::error::{error}", file=sys.stderr)
+        sys.exit(1)
 
-    result = build_config(config, args.app_name, args.stack_name)
+    if args.matrix:
+        result = build_matrix(config, targets)
+    else:
+        result = build_config(config, args.app_name, args.stack_name)
     print(json.dumps(result, separators=(",", ":")))
 
 
@@ -1,17 +1,32 @@
 #!/usr/bin/env -S uv run --script
 # /// script
 # requires-python = ">=3.12"
-# dependencies = ["pytest"]
+# dependencies = [
+#     # renovate: datasource=pypi depName=pytest
+#     "pytest==9.1.1",
+#     # renovate: datasource=pypi depName=jsonschema
+#     "jsonschema==4.26.0",
+#     # renovate: datasource=pypi depName=referencing
+#     "referencing==0.37.0",
+# ]
 # ///
 """Tests for build_config.py."""
 
 import copy
+import http.server
 import json
+import socket
+import sys
+import threading
 from pathlib import Path
 
-from build_config import build_config
+import pytest
+
+import build_config as build_config_module
+from build_config import SchemaCache, build_config, build_matrix, parse_targets, validate_config
 
 TESTDATA = Path(__file__).parent / "testdata-python"
+TESTDATA_CI = Path(__file__).parent / "testdata-ci"
 
 
 def load(name: str) -> dict:
@@ -45,3 +60,152 @@ def test_no_monorepo_uses_env_name_as_concurrency_group():
     result = build_config(config, app_name="my-app", stack_name="")
     assert result["dev"]["concurrencyGroup"] == "pirates-dev"
     assert result["prod"]["concurrencyGroup"] == "pirates-prod"
+
+
+@pytest.fixture
+def schema_server():
+    """Serve testdata-ci/dummy-schema.json over HTTP, counting the requests."""
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            body = (TESTDATA_CI / "dummy-schema.json").read_bytes()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/schema.json", requests
+    server.shutdown()
+
+
+def test_validate_valid_config(tmp_path):
+    config = json.loads((TESTDATA_CI / "dummy-config.json").read_text())
+    schema = str(TESTDATA_CI / "dummy-schema.json")
+    assert validate_config(config, "dummy-config.json", SchemaCache(tmp_path), schema) == []
+
+
+def test_validate_invalid_config(tmp_path):
+    config = json.loads((TESTDATA_CI / "invalid-config.json").read_text())
+    schema = str(TESTDATA_CI / "dummy-schema.json")
+    assert validate_config(config, "invalid-config.json", SchemaCache(tmp_path), schema) == [
+        "invalid-config.json::$: 'team' is a required property",
+        "invalid-config.json::$: 'dev' is a required property",
+    ]
+
+
+def test_validate_config_without_schema(tmp_path):
+    assert validate_config({"type": "app"}, "config.json", SchemaCache(tmp_path)) == [
+        "Config file config.json is not using any schema."
+    ]
+
+
+def test_remote_schema_is_cached(tmp_path, schema_server):
+    url, requests = schema_server
+    config = json.loads((TESTDATA_CI / "dummy-config.json").read_text())
+
+    assert validate_config(config, "config.json", SchemaCache(tmp_path), url) == []
+    assert validate_config(config, "config.json", SchemaCache(tmp_path), url) == []
+    assert len(requests) == 1
+
+
+def test_remote_schema_is_refetched_if_cache_is_corrupt_or_stale(tmp_path, schema_server):
+    url, requests = schema_server
+    SchemaCache(tmp_path).load(url)
+
+    for cached in tmp_path.glob("*.json"):
+        if not cached.name.endswith(".index.json"):
+            cached.write_text("{}")
+    content, _ = SchemaCache(tmp_path).load(url)
+    assert json.loads(content) == json.loads((TESTDATA_CI / "dummy-schema.json").read_text())
+
+    SchemaCache(tmp_path, max_age=0).load(url)
+    assert len(requests) == 3
+
+
+def unused_url() -> str:
+    """A URL on a local port nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}/schema.json"
+
+
+def test_missing_schema_file_is_reported(tmp_path):
+    schema = str(tmp_path / "missing.json")
+    assert validate_config({}, "config.json", SchemaCache(tmp_path), schema) == [
+        f"Could not read schema {schema}: No such file or directory"
+    ]
+
+
+def test_unreachable_schema_is_reported(tmp_path):
+    url = unused_url()
+    [error] = validate_config({}, "config.json", SchemaCache(tmp_path), url)
+    assert error.startswith(f"Could not fetch schema {url}: ")
+
+
+def test_unreachable_schema_reference_is_reported(tmp_path):
+    url = unused_url()
+    schema = tmp_path / "schema.json"
+    schema.write_text(json.dumps({"properties": {"dev": {"$ref": url}}}))
+    [error] = validate_config({"dev": {}}, "config.json", SchemaCache(tmp_path), str(schema))
+    assert error.startswith(f"Could not fetch schema {url}: ")
+
+
+def test_missing_config_file_is_reported(tmp_path, monkeypatch, capsys):
+    config_file = tmp_path / "missing.json"
+    monkeypatch.setattr(sys, "argv", ["build_config.py", "--config-file", str(config_file)])
+    with pytest.raises(SystemExit) as exit_info:
+        build_config_module.main()
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().err == f"::error::Could not read config file {config_file}: No such file or directory\n"
+
+
+def test_validator_is_compiled_once(tmp_path):
+    schemas = SchemaCache(tmp_path)
+    schema = str(TESTDATA_CI / "dummy-schema.json")
+    assert schemas.validator(schema) is schemas.validator(schema)
+
+
+def test_build_config_does_not_modify_input():
+    config = load("full.json")
+    original = copy.deepcopy(config)
+    build_config(config, app_name="my-app", stack_name="app-example")
+    assert config == original
+
+
+def test_build_matrix():
+    config = load("full.json")
+    matrix = build_matrix(
+        config,
+        [
+            {"app-name": "my-app", "stack-name": "app-example"},
+            {"app-name": "other-app", "stack-name": "app-other"},
+            {"stack-name": "app-example"},
+        ],
+    )
+
+    assert [(entry["app-name"], entry["stack-name"]) for entry in matrix["include"]] == [
+        ("my-app", "app-example"),
+        ("other-app", "app-other"),
+        ("", "app-example"),
+    ]
+    assert matrix["include"][0]["config"] == load("full-expected.json")
+    assert matrix["include"][1]["config"]["dev"]["stackDir"] == "stacks/dev/app-other"
+    assert matrix["include"][1]["config"]["dev"]["concurrencyGroup"] == "pirates-dev-other-app"
+    assert "appName" not in matrix["include"][2]["config"]
+    assert config == load("full.json")
+
+
+@pytest.mark.parametrize(
+    "raw",
+    ['{"app-name": "a"}', '["app-a"]', '[{"app": "a"}]', '[{"app-name": 1}]'],
+)
+def test_parse_targets_rejects_invalid_input(raw):
+    with pytest.raises(ValueError):
+        parse_targets(raw)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark determine_stacks.py against synthetic monorepos of increasing size.
+
+Generates a monorepo per size (stacks spread over environments and nested groups, with
+shared modules and non-stack directories in between) and a changed-file list, then times
+the main building blocks and a full main() run. Results are written as JSON and can be
+compared against a previous run to catch performance regressions.
+
+Usage:
+  python3 benchmark_determine_stacks.py --sizes 100,1000,10000 --output results.json
+  python3 benchmark_determine_stacks.py --baseline results.json --threshold 0.25
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from determine_stacks import (
+    build_stack_index,
+    classify_stacks,
+    files_to_dirs,
+    get_dirs_from_glob,
+    is_terraform_stack,
+    main,
+)
+
+# Same as the default core stacks in action.yml
+CORE_STACKS = [
+    "**/remote-state",
+    "**/networking-data",
+    "**/networking",
+    "**/dns",
+    "**/certificates",
+    "**/load-balancing-*-data",
+    "**/load-balancing-*",
+    "**/iam",
+    "**/app-common",
+    "**/datadog-common",
+    "**/databases",
+    "**/rds-bastion",
+    "**/cicd-common",
+    "**/*-data",
+]
+
+ENVIRONMENTS = ["dev", "qa", "test", "prod"]
+
+
+def generate_monorepo(root: Path, stacks: int, tf_size: int, seed: int = 0) -> list[str]:
+    """Create a synthetic monorepo with the given number of stacks and return their paths.
+
+    Stacks are padded with `tf_size` bytes of resources before the backend block, so
+    detection has to read past them. Every tenth directory is a module or script
+    directory without a backend.
+    """
+    rng = random.Random(seed)
+    core_names = [p.removeprefix("**/").replace("*", "x") for p in CORE_STACKS]
+    padding = 'resource "null_resource" "r" {\n  triggers = { x = "%s" }\n}\n'
+    created = []
+    for i in range(stacks):
+        env = ENVIRONMENTS[i % len(ENVIRONMENTS)]
+        group = f"team-{rng.randrange(max(stacks // 50, 1))}"
+        name = rng.choice(core_names) if i % 7 == 0 else f"app-{i}"
+        stack = f"stacks/{env}/{group}/{name}-{i}"
+        (root / stack).mkdir(parents=True)
+        body = (padding % ("x" * 64)) * max(tf_size // 100, 0)
+        (root / stack / "resources.tf").write_text(body)
+        (root / stack / "main.tf").write_text(
+            body + f'terraform {{\n  backend "s3" {{\n    key = "{stack}/terraform.tfstate"\n  }}\n}}\n'
+        )
+        created.append(stack)
+        if i % 10 == 0:
+            (root / f"modules/module-{i}").mkdir(parents=True)
+            (root / f"modules/module-{i}/main.tf").write_text(body)
+            (root / stack / "bin").mkdir()
+            (root / stack / "bin/script.sh").write_text("#!/bin/sh\n")
+    return created
+
+
+def generate_changed_files(stacks: list[str], count: int, seed: int = 0) -> list[str]:
+    """Generate a list of changed files spread over the given stacks."""
+    rng = random.Random(seed)
+    return [f"{rng.choice(stacks)}/file-{i}.tf" for i in range(count)]
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    """Return the fastest wall time of repeated calls to fn, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_main(root: Path, selected_stacks: str) -> dict:
+    """Run main() quietly against root with the given stack selection."""
+    env = {
+        "SELECTED_STACKS": selected_stacks,
+        "IGNORED_STACKS": "",
+        "CORE_STACKS": "\n".join(CORE_STACKS),
+        "ADDITIONAL_CORE_STACKS": "",
+        "CHANGED_FILES": "",
+        "CHANGED_FILES_FILE": "",
+        "DEPENDENCY_WAVES": "true",
+    }
+    with contextlib.redirect_stderr(io.StringIO()), _patched_environ(env):
+        return main(None, root)
+
+
+@contextlib.contextmanager
+def _patched_environ(env: dict[str, str]):
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def benchmark_size(size: int, tf_size: int, changed_files: int, repeat: int) -> dict[str, float]:
+    """Time each part of determine_stacks against a generated monorepo of the given size."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        stacks = generate_monorepo(root, size, tf_size)
+        changed = generate_changed_files(stacks, min(changed_files, size * 10))
+        selected = ["**/{dev,prod}/**"]
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            return {
+                "get_dirs_from_glob": best_of(lambda: get_dirs_from_glob(root, selected), repeat),
+                "files_to_dirs": best_of(lambda: files_to_dirs(changed), repeat),
+                "is_terraform_stack": best_of(lambda: [is_terraform_stack(root / s) for s in stacks], repeat),
+                "build_stack_index": best_of(lambda: build_stack_index(root), repeat),
+                "classify_stacks": best_of(lambda: classify_stacks(stacks, CORE_STACKS), repeat),
+                "main": best_of(lambda: run_main(root, "**"), repeat),
+            }
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float = 0.005) -> list[str]:
+    """List the benchmarks that got slower than baseline by more than threshold.
+
+    Timings below min_seconds are ignored, as they're dominated by noise.
+    """
+    regressions = []
+    for size, timings in results.items():
+        for name, seconds in timings.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None or max(before, seconds) < min_seconds:
+                continue
+            if seconds > before * (1 + threshold):
+                regressions.append(f"{name} @ {size} stacks: {before:.4f}s -> {seconds:.4f}s (+{seconds / before - 1:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark determine_stacks.py on synthetic monorepos")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated numbers of stacks")
+    parser.add_argument("--tf-size", type=int, default=4096, help="Approximate size of each .tf file in bytes")
+    parser.add_argument("--changed-files", type=int, default=100_000, help="Maximum number of changed files")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per benchmark (best is kept)")
+    parser.add_argument("--output", type=Path, help="Write results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, help="Compare results against a previous --output file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown vs. baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = {}
+    for size in (int(s) for s in args.sizes.split(",")):
+        results[str(size)] = benchmark_size(size, args.tf_size, args.changed_files, args.repeat)
+        for name, seconds in results[str(size)].items():
+            print(f"{size:>6} stacks  {name:<20} {seconds * 1000:10.2f} ms")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.baseline:
+        if regressions := compare(results, json.loads(args.baseline.read_text()), args.threshold):
+            print("\nPerformance regressions:", *regressions, sep="\n  ", file=sys.stderr)
+            sys.exit(1)
+        print(f"\nNo regressions above {args.threshold:.0%} compared to {args.baseline}")
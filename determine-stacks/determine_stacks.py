@@ -5,12 +5,20 @@ Determine and classify Terraform stacks based on various filters and heuristics.
 To be used in CI/CD pipelines to identify which stacks to operate on.
 """
 
+import hashlib
+import itertools
 import json
 import os
+import posixpath
 import re
+import subprocess
 import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from pathlib import Path, PurePosixPath
-from typing import TextIO
+from typing import BinaryIO, Iterable, Iterator, TextIO, TypedDict
 
 
 def eprint(*args, **kwargs) -> None:
@@ -22,7 +30,8 @@ def determine_stack_environment(
     stack_path: str, dev_envs={"dev", "qa", "test"}, prod_envs={"prod"}
 ) -> str | None:
     """Use heuristics to determine what type of environment a stack belongs to."""
-    for part in Path(stack_path).parts:
+    # Splitting on "/" yields the same named components as Path.parts, without the overhead
+    for part in stack_path.split("/"):
         part_lower = part.lower()
         if part_lower in dev_envs:
             return "dev"
@@ -31,6 +40,45 @@ def determine_stack_environment(
     return None
 
 
+BRACE_GROUP = re.compile(r"\{([^{}]+)\}")
+
+
+def validate_braces(pattern: str) -> None:
+    """Raise ValueError if a pattern has invalid brace syntax (unmatched/nested/empty braces)."""
+    # Check for unmatched braces
+    if pattern.count("{") != pattern.count("}"):
+        raise ValueError(f"Unmatched braces in pattern: {pattern}")
+
+    # Check for nested braces
+    if re.search(r"\{[^{}]*\{", pattern):
+        raise ValueError(f"Nested braces not supported: {pattern}")
+
+    # Check for empty braces
+    if "{}" in pattern:
+        raise ValueError(f"Empty braces in pattern: {pattern}")
+
+    # Check for empty alternatives
+    for match in BRACE_GROUP.finditer(pattern):
+        if any(alt.strip() == "" for alt in match.group(1).split(",")):
+            raise ValueError(f"Empty alternative in braces: {pattern}")
+
+
+def iter_expand_braces(pattern: str) -> Iterator[str]:
+    """Lazily expand bash-style brace patterns into multiple patterns.
+
+    Patterns are generated one at a time in the same order as expand_braces, so callers
+    that stop early never materialize the full product of all alternatives.
+
+    Raises ValueError on invalid syntax (unmatched/nested/empty braces).
+    """
+    validate_braces(pattern)
+    pieces = BRACE_GROUP.split(pattern)
+    # Odd pieces are the contents of brace groups, even pieces the literal text between them
+    choices = [piece.split(",") if i % 2 else [piece] for i, piece in enumerate(pieces)]
+    for combination in itertools.product(*choices):
+        yield "".join(combination)
+
+
 def expand_braces(pattern: str) -> list[str]:
     """
     Expand bash-style brace patterns into multiple patterns.
@@ -43,88 +91,529 @@ def expand_braces(pattern: str) -> list[str]:
 
     Raises ValueError on invalid syntax (unmatched/nested/empty braces).
     """
-    # Check for unmatched braces
-    if pattern.count("{") != pattern.count("}"):
-        raise ValueError(f"Unmatched braces in pattern: {pattern}")
+    return list(iter_expand_braces(pattern))
 
-    # Check for nested braces
-    if re.search(r"\{[^{}]*\{", pattern):
-        raise ValueError(f"Nested braces not supported: {pattern}")
 
-    # Check for empty braces
-    if "{}" in pattern:
-        raise ValueError(f"Empty braces in pattern: {pattern}")
+def braces_span_segments(pattern: str) -> bool:
+    """Check if any brace alternative changes the segment structure of a pattern.
 
-    match = re.search(r"\{([^{}]+)\}", pattern)
-    if not match:
-        return [pattern]
+    Alternatives containing `/`, or that are `**` or `.`, can't be compiled into an
+    alternation within a single segment and require literal expansion instead.
+    """
+    return any(
+        "/" in alt or alt in ("**", ".")
+        for match in BRACE_GROUP.finditer(pattern)
+        for alt in match.group(1).split(",")
+    )
 
-    prefix = pattern[: match.start()]
-    suffix = pattern[match.end() :]
-    alternatives = match.group(1).split(",")
 
-    # Check for empty alternatives
-    if any(alt.strip() == "" for alt in alternatives):
-        raise ValueError(f"Empty alternative in braces: {pattern}")
+def translate_segment(segment: str) -> str:
+    """Translate a single glob path segment (`*`, `?`, `[...]` and `{a,b}`) to a regex.
 
+    Brace groups become regex alternations instead of being expanded, so the size of the
+    regex grows with the sum of the alternatives rather than their product.
+    """
     result = []
-    for alt in alternatives:
-        result.extend(expand_braces(prefix + alt + suffix))
-    return result
+    i, n = 0, len(segment)
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == "*":
+            # Consecutive stars behave like a single star within a segment
+            if not result or result[-1] != "[^/]*":
+                result.append("[^/]*")
+        elif c == "?":
+            result.append("[^/]")
+        elif c == "{" and (j := segment.find("}", i)) != -1:
+            alternatives = segment[i:j].split(",")
+            result.append("(?:" + "|".join(translate_segment(alt) for alt in alternatives) + ")")
+            i = j + 1
+        elif c == "[":
+            j = i
+            if j < n and segment[j] == "!":
+                j += 1
+            if j < n and segment[j] == "]":
+                j += 1
+            j = segment.find("]", j)
+            if j == -1:
+                result.append(re.escape(c))
+                continue
+            body = segment[i:j].replace("\\", "\\\\")
+            i = j + 1
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            elif body.startswith(("^", "[")):
+                body = "\\" + body
+            result.append(f"[{body}]")
+        else:
+            result.append(re.escape(c))
+    return "".join(result)
+
+
+def translate_glob(pattern: str) -> str:
+    """Translate a glob pattern to a regex with the same semantics as PurePosixPath.full_match.
+
+    `**` matches any number of path segments (including none), `*` matches within a
+    single segment, and the pattern must match the whole path.
+    """
+    if braces_span_segments(pattern):
+        return "(?:" + "|".join(translate_glob(p) for p in iter_expand_braces(pattern)) + ")"
+
+    prefix = "/" if pattern.startswith("/") else ""
+    parts = [p for p in pattern.split("/") if p not in ("", ".")]
+    last = len(parts) - 1
+    result = [prefix]
+    for idx, part in enumerate(parts):
+        if part == "**":
+            if idx < last:
+                if parts[idx + 1] != "**":
+                    result.append("(?:.+/)?")
+            else:
+                result.append(".*")
+            continue
+        if part == "*":
+            result.append("[^/]+")
+        else:
+            result.append(translate_segment(part))
+        if idx < last:
+            result.append("/")
+    return "".join(result)
+
+
+class PatternMatcher:
+    """Match paths against an ordered list of glob patterns with a single compiled regex.
+
+    Patterns may contain `**`, `*`, `?`, `[...]` and brace alternatives (`{a,b}`), and are
+    matched against the full path like PurePosixPath.full_match. The whole list is compiled
+    once into one alternation, so each path is matched in a single pass and the index of
+    the first matching pattern is returned (first pattern wins).
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(patterns)
+        for pattern in self.patterns:
+            validate_braces(pattern)
+        alternatives = [f"({translate_glob(pattern)})" for pattern in self.patterns]
+        self._regex = re.compile("|".join(alternatives), re.DOTALL) if alternatives else None
+
+    def match(self, path: str) -> int | None:
+        """Return the index of the first pattern matching path, or None if none match."""
+        if self._regex is None:
+            return None
+        # An empty path is represented as "." but shouldn't match wildcards
+        m = self._regex.fullmatch("" if path == "." else path)
+        return None if m is None else m.lastindex - 1
+
+    def matches(self, path: str) -> bool:
+        """Check if any pattern matches path."""
+        return self.match(path) is not None
+
+
+# Number of files (and bytes) read from disk, for profiling
+IO_COUNTERS: Counter[str] = Counter()
+
+# Marker that identifies a directory as a Terraform stack (as opposed to e.g. a module)
+S3_BACKEND_MARKER = b'backend "s3"'
+
+# Directories that never contain stacks and are expensive to walk
+DEFAULT_SKIPPED_DIRECTORIES = frozenset({".git", ".terraform", "node_modules"})
+
+
+def file_contains(path: str | os.PathLike, needle: bytes, chunk_size: int = 64 * 1024) -> bool:
+    """Stream a file in fixed-size chunks, stopping at the first occurrence of needle.
+
+    Memory use is bounded by chunk_size regardless of the file size. The tail of each
+    chunk is carried over so matches that straddle a chunk boundary are still found.
+    """
+    overlap = len(needle) - 1
+    tail = b""
+    with open(path, "rb") as f:
+        IO_COUNTERS["files_read"] += 1
+        while chunk := f.read(chunk_size):
+            IO_COUNTERS["bytes_read"] += len(chunk)
+            window = tail + chunk
+            if needle in window:
+                return True
+            tail = window[-overlap:] if overlap else b""
+    return False
+
+
+def has_s3_backend(tf_files: Iterable[str | os.PathLike]) -> bool:
+    """Check if any of the given .tf files mentions an S3 backend."""
+    for tf_file in tf_files:
+        try:
+            if file_contains(tf_file, S3_BACKEND_MARKER):
+                return True
+        except OSError:
+            pass
+    return False
+
+
+def scan_tf_files(path: str | os.PathLike) -> list[os.DirEntry]:
+    """List the .tf file entries directly inside a directory (empty if it can't be read)."""
+    try:
+        with os.scandir(path) as entries:
+            return [e for e in entries if e.name.endswith(".tf") and e.is_file()]
+    except OSError:
+        return []
+
+
+def list_tf_files(path: str | os.PathLike) -> list[str]:
+    """List the paths of the .tf files directly inside a directory."""
+    return [e.path for e in scan_tf_files(path)]
 
 
 def is_terraform_stack(path: Path) -> bool:
     """Use heuristics to determine if a directory is a Terraform stack."""
     # Check for at least one .tf file that mentions an S3 backend
-    for tf_file in path.glob("*.tf"):
+    return has_s3_backend(list_tf_files(path))
+
+
+def walk_dirs(
+    root: Path, skipped_dirs: frozenset[str] = DEFAULT_SKIPPED_DIRECTORIES
+) -> Iterator[tuple[str, list[os.DirEntry]]]:
+    """Walk the tree under root with os.scandir, yielding (relative dir, entries) once per directory.
+
+    Symlinked directories are not followed, and directories named in skipped_dirs are pruned.
+    """
+    stack = [(str(root), ".")]
+    while stack:
+        path, rel = stack.pop()
         try:
-            if 'backend "s3"' in tf_file.read_text():
-                return True
-        except Exception:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        yield rel, entries
+        for entry in entries:
+            if entry.name not in skipped_dirs and entry.is_dir(follow_symlinks=False):
+                stack.append((entry.path, entry.name if rel == "." else f"{rel}/{entry.name}"))
+
+
+def git_blob_ids(root: Path) -> dict[str, str]:
+    """Map the tracked, unmodified .tf files under root to their git blob ids.
+
+    Paths are relative to root. Returns an empty dict if root isn't inside a git work tree.
+    """
+    try:
+        staged = subprocess.run(
+            ["git", "ls-files", "--stage", "-z", "--", "*.tf"], cwd=root, capture_output=True, check=True
+        ).stdout
+        modified = subprocess.run(
+            ["git", "ls-files", "--modified", "-z", "--", "*.tf"], cwd=root, capture_output=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+
+    modified_paths = set(modified.decode(errors="surrogateescape").split("\0"))
+    blob_ids = {}
+    for record in staged.decode(errors="surrogateescape").split("\0"):
+        if not record:
+            continue
+        info, path = record.split("\t", 1)
+        if path not in modified_paths:
+            blob_ids[path] = info.split()[1]
+    return blob_ids
+
+
+class StackCache:
+    """On-disk cache of stack detection results that can be restored between CI runs.
+
+    Each directory is stored with a fingerprint of its .tf files: git blob ids for tracked,
+    unmodified files (stable across fresh checkouts) and size/mtime for anything else.
+    A directory is only rescanned when its fingerprint changes, and entries for directories
+    that no longer exist are dropped when the cache is saved.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self._blob_ids = git_blob_ids(root)
+        self._entries: dict[str, list] = {}
+        try:
+            data = json.loads(path.read_text())
+            if data.get("version") == self.VERSION:
+                # Malformed entries (e.g. from a hand-edited file) are dropped and rescanned
+                self._entries = {
+                    rel: entry
+                    for rel, entry in data["entries"].items()
+                    if isinstance(entry, list)
+                    and len(entry) == 2
+                    and isinstance(entry[0], str)
+                    and isinstance(entry[1], bool)
+                }
+        except FileNotFoundError:
             pass
-    return False
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            eprint(f"Ignoring unreadable stack cache {path}: {e}")
+
+    def fingerprint(self, rel: str, tf_files: list[os.DirEntry]) -> str:
+        """Fingerprint a directory from the identity of its .tf files, without reading them."""
+        parts = []
+        for entry in sorted(tf_files, key=lambda e: e.name):
+            blob_id = self._blob_ids.get(entry.name if rel == "." else f"{rel}/{entry.name}")
+            if blob_id is None:
+                stat = entry.stat()
+                blob_id = f"{stat.st_size}:{stat.st_mtime_ns}"
+            parts.append(f"{entry.name}\0{blob_id}")
+        return hashlib.sha1("\0".join(parts).encode(errors="surrogateescape")).hexdigest()[:16]
+
+    def is_stack(self, rel: str, tf_files: list[os.DirEntry]) -> bool:
+        """Look up whether a directory is a stack, scanning and storing it on a miss."""
+        try:
+            fingerprint = self.fingerprint(rel, tf_files)
+        except OSError:
+            return has_s3_backend(tf_files)
+
+        entry = self._entries.get(rel)
+        if entry is not None and entry[0] == fingerprint:
+            self.hits += 1
+            return entry[1]
 
+        self.misses += 1
+        is_stack = has_s3_backend(tf_files)
+        self._entries[rel] = [fingerprint, is_stack]
+        return is_stack
 
-def get_dirs_from_glob(root: Path, globs: list[str]) -> list[str]:
+    def save(self) -> None:
+        """Atomically write the cache back to disk, without entries for deleted directories."""
+        self._entries = {rel: entry for rel, entry in self._entries.items() if (self.root / rel).is_dir()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.write_text(json.dumps({"version": self.VERSION, "entries": self._entries}, separators=(",", ":")))
+        os.replace(tmp, self.path)
+        eprint(f"Stack cache: {self.hits} hits, {self.misses} misses ({len(self._entries)} entries in {self.path})")
+
+
+def build_stack_index(
+    root: Path,
+    dirs: Iterable[str] | None = None,
+    skipped_dirs: frozenset[str] = DEFAULT_SKIPPED_DIRECTORIES,
+    cache: StackCache | None = None,
+) -> set[str]:
+    """Determine the set of Terraform stack directories under root.
+
+    If dirs is given, only those directories (relative to root) are checked. Otherwise the
+    whole tree is walked once. Either way each directory is listed with a single
+    os.scandir call and each .tf file is scanned only until the S3 backend marker is found,
+    so callers can answer every membership check from the returned set. With a cache,
+    directories whose .tf files haven't changed since the last run aren't scanned at all.
+    """
+
+    def is_stack(rel: str, tf_files: list[os.DirEntry]) -> bool:
+        if not tf_files:
+            return False
+        return cache.is_stack(rel, tf_files) if cache else has_s3_backend(tf_files)
+
+    if dirs is not None:
+        return {d for d in dirs if is_stack(d, scan_tf_files(root / d))}
+
+    index = set()
+    for rel, entries in walk_dirs(root, skipped_dirs):
+        if is_stack(rel, [e for e in entries if e.name.endswith(".tf") and e.is_file()]):
+            index.add(rel)
+    return index
+
+
+def compile_glob_segments(pattern: str) -> tuple[list[re.Pattern | None], bool]:
+    """Compile a glob pattern into per-segment regexes for matching during a directory walk.
+
+    `**` segments are represented as None. Also returns whether the pattern only matches
+    directories, which is the case if it has a trailing slash or ends with `**` (like
+    Path.glob, a trailing `**` doesn't match files).
+    """
+    segments: list[re.Pattern | None] = []
+    for part in pattern.split("/"):
+        if part in ("", "."):
+            continue
+        if part == "**":
+            if not segments or segments[-1] is not None:
+                segments.append(None)
+        else:
+            segments.append(re.compile("[^/]+" if part == "*" else translate_segment(part), re.DOTALL))
+    return segments, pattern.endswith("/") or bool(segments) and segments[-1] is None
+
+
+def get_dirs_from_glob(
+    root: Path,
+    globs: list[str],
+    skipped_dirs: frozenset[str] = DEFAULT_SKIPPED_DIRECTORIES,
+) -> list[str]:
     """
     Expand glob patterns to matching stack directories.
 
     - If a pattern matches a directory, consider that directory.
     - If a pattern matches a file, consider its parent directory.
     - De-duplicate
+
+    All patterns are matched simultaneously during a single walk of the tree: each directory
+    carries the set of (pattern, segment) positions that are still possible, and subtrees
+    where no pattern can match anymore are never entered. Directories named in skipped_dirs
+    are not searched. Like Path.glob, `**` doesn't descend into symlinked directories.
     """
-    dirs: set[Path] = set()
+    return get_dirs_from_glob_groups(root, [globs], skipped_dirs)[0]
+
+
+def get_dirs_from_glob_groups(
+    root: Path,
+    groups: list[list[str]],
+    skipped_dirs: frozenset[str] = DEFAULT_SKIPPED_DIRECTORIES,
+) -> list[list[str]]:
+    """Like get_dirs_from_glob, but for several independent groups of patterns at once.
+
+    The tree is walked a single time for all groups, and the matching directories are
+    returned per group.
+    """
+    compiled = []
+    for group, globs in enumerate(groups):
+        for pattern in globs:
+            validate_braces(pattern)
+            for p in iter_expand_braces(pattern) if braces_span_segments(pattern) else [pattern]:
+                compiled.append((*compile_glob_segments(p), group))
+
+    def closure(states: set[tuple[int, int]]) -> set[tuple[int, int]]:
+        # `**` also matches zero segments, so a position on `**` implies the next position
+        result = set(states)
+        for i, pos in states:
+            segments = compiled[i][0]
+            while pos < len(segments) and segments[pos] is None:
+                pos += 1
+                result.add((i, pos))
+        return result
 
-    for pattern in globs:
-        for path in root.glob(pattern):
-            candidate = path if path.is_dir() else path.parent
-            # Only keep dirs under root
+    def step(states: set[tuple[int, int]], name: str, recursive: bool) -> set[tuple[int, int]]:
+        result = set()
+        for i, pos in states:
+            segments = compiled[i][0]
+            if pos == len(segments):
+                continue
+            if segments[pos] is None:
+                if recursive:
+                    result.add((i, pos))
+            elif segments[pos].fullmatch(name):
+                result.add((i, pos + 1))
+        return closure(result)
+
+    def accepted_groups(states: set[tuple[int, int]], is_dir: bool) -> set[int]:
+        return {
+            compiled[i][2]
+            for i, pos in states
+            if pos == len(compiled[i][0]) and (is_dir or not compiled[i][1])
+        }
+
+    def viable(states: set[tuple[int, int]]) -> bool:
+        return any(pos < len(compiled[i][0]) for i, pos in states)
+
+    dirs: list[set[str]] = [set() for _ in groups]
+    initial = closure({(i, 0) for i in range(len(compiled))})
+    for group in accepted_groups(initial, is_dir=True):
+        dirs[group].add(".")
+
+    stack = [(str(root), "", initial)] if viable(initial) else []
+    while stack:
+        path, rel, states = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.name in skipped_dirs:
+                continue
             try:
-                candidate.relative_to(root)
-            except ValueError:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            child_rel = f"{rel}/{entry.name}" if rel else entry.name
+            child_states = step(states, entry.name, recursive=True)
+            for group in accepted_groups(child_states, is_dir):
+                dirs[group].add(child_rel if is_dir else rel or ".")
+            if not is_dir:
+                continue
+            if entry.is_symlink():
+                child_states = step(states, entry.name, recursive=False)
+            if viable(child_states):
+                stack.append((entry.path, child_rel, child_states))
+
+    return [sorted(d) for d in dirs]
+
+
+def iter_path_list(stream: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Lazily yield paths from a NUL- or newline-delimited byte stream.
+
+    The stream is treated as NUL-delimited (as with e.g. `git diff --name-only -z`) if a NUL
+    byte has been read by the time the first delimiter is seen, and newline-delimited otherwise.
+    Blank entries are skipped and a trailing carriage return is dropped, but paths are
+    otherwise yielded as is, since they may start or end with spaces. Only one chunk and one
+    partial path are held in memory at a time.
+    """
+    delimiter = None
+    pending = b""
+    while chunk := stream.read(chunk_size):
+        pending += chunk
+        if delimiter is None:
+            if b"\0" in pending:
+                delimiter = b"\0"
+            elif b"\n" in pending:
+                delimiter = b"\n"
+            else:
                 continue
-            if candidate.is_dir:
-                dirs.add(candidate)
+        *paths, pending = pending.split(delimiter)
+        for path in paths:
+            if path.strip():
+                yield path.removesuffix(b"\r").decode(errors="surrogateescape")
+    if pending.strip():
+        yield pending.removesuffix(b"\r").decode(errors="surrogateescape")
+
+
+def git_changed_files(root: Path, base: str, head: str = "HEAD") -> Iterator[str]:
+    """Lazily yield the paths changed between the merge base of base and head, and head.
+
+    Equivalent to `git diff --name-only base...head`, with paths relative to root. Renames are
+    reported as a deletion and an addition, so both the old and the new path are yielded.
+    The diff is streamed, so only one chunk of output is held in memory at a time.
+    """
+    command = ["git", "diff", "--name-only", "-z", "--no-renames", "--relative", f"{base}...{head}", "--"]
+    # stderr goes to a file, as a full stderr pipe would block git while stdout is read
+    with tempfile.TemporaryFile() as errors:
+        with subprocess.Popen(command, cwd=root, stdout=subprocess.PIPE, stderr=errors) as proc:
+            yield from iter_path_list(proc.stdout)
+        errors.seek(0)
+        stderr = errors.read().decode(errors="replace").strip()
+    if proc.returncode != 0:
+        # Typically a shallow clone without the merge base, or an unknown ref
+        raise RuntimeError(f"Failed to list changed files between {base} and {head}: {stderr}")
+
 
-    return sorted(str(d.relative_to(root)) for d in dirs)
+def parent_dir(path: str) -> str:
+    """Return the directory containing a file, like str(PurePosixPath(path).parent).
 
+    If the file is inside a `.boilerplate` directory, the directory containing that is
+    returned instead, as that's the actual stack directory.
+    """
+    if path in ("", ".") or path.startswith(("/", "./")) or path.endswith(("/", "/.")) or "//" in path or "/./" in path:
+        # Rare paths that need normalizing
+        parent = PurePosixPath(path).parent
+        return str(parent.parent if parent.name == ".boilerplate" else parent)
+    # Fast path for already normalized (e.g. git) paths
+    parent = path.rpartition("/")[0]
+    if parent == ".boilerplate" or parent.endswith("/.boilerplate"):
+        parent = parent.removesuffix(".boilerplate").removesuffix("/")
+    return parent or "."
 
-def files_to_dirs(files: list[str]) -> list[str]:
-    """Convert file paths to unique parent directories."""
-    seen = set()
-    directories = []
-    for path in files:
-        path_obj = PurePosixPath(path).parent
-        # If a file inside .boilerplate dir has been changed, we consider the parent dir instead
-        # as that's the actual stack dir
-        if path_obj.name == ".boilerplate":
-            path_obj = path_obj.parent
 
-        if (d := str(path_obj)) not in seen:
-            seen.add(d)
-            directories.append(d)
+def files_to_dirs(files: Iterable[str]) -> list[str]:
+    """Convert file paths to unique parent directories.
 
-    return sorted(directories)
+    Files are consumed one at a time, so memory use is proportional to the number of
+    unique directories rather than the number of files.
+    """
+    return sorted({parent_dir(path) for path in files})
 
 
 def separate_by_environment(dirs: list[str]) -> tuple[list[str], list[str], list[str]]:
@@ -136,24 +625,21 @@ def separate_by_environment(dirs: list[str]) -> tuple[list[str], list[str], list
 
 
 def classify_stacks(
-    paths: list[str], patterns: list[str]
+    paths: list[str], patterns: list[str] | PatternMatcher
 ) -> tuple[list[str], list[str]]:
     """Classify stacks into a group of paths that match patterns and those that don't.
 
     Matched stacks are ordered by the pattern that matched them (first pattern first),
     preserving the input order for stacks matched by the same pattern.
     """
+    matcher = patterns if isinstance(patterns, PatternMatcher) else PatternMatcher(patterns)
+
     # Map each matched path to the index of the pattern that matched it
     matched: dict[str, int] = {}
     miss = []
 
     for p in paths:
-        pp = PurePosixPath(p)
-        pattern_idx = None
-        for i, pat in enumerate(patterns):
-            if pp.full_match(pat):
-                pattern_idx = i
-                break
+        pattern_idx = matcher.match(p)
         if pattern_idx is not None:
             matched[p] = pattern_idx
         else:
@@ -164,6 +650,184 @@ def classify_stacks(
     return hit, miss
 
 
+class TerraformReferences(TypedDict):
+    backend_key: str | None
+    remote_state_keys: list[str]
+    module_sources: list[str]
+
+
+def strip_hcl_comments(
+    text: str,
+    comment_start: re.Pattern = re.compile(r"#|//|/\*"),
+    token: re.Pattern = re.compile(r'("(?:\\.|[^"\\])*")|(?:#|//)[^\n]*|/\*.*?\*/', re.DOTALL),
+) -> str:
+    """Remove `#`, `//` and `/* */` comments from HCL, leaving string literals intact."""
+    if not comment_start.search(text):
+        return text
+    # Comments match with an empty group 1, which is substituted as ""
+    return token.sub(r"\1", text)
+
+
+def find_hcl_blocks(
+    text: str, header: re.Pattern, special: re.Pattern = re.compile(r'[{}"\\]')
+) -> Iterator[str]:
+    """Yield the body of every HCL block whose header (up to and including `{`) matches.
+
+    Comments must have been stripped from text, so that commented-out headers and braces
+    or quotes inside comments aren't mistaken for code.
+    """
+    for match in header.finditer(text):
+        depth, i, in_string = 1, match.end(), False
+        while depth and (m := special.search(text, i)):
+            c, i = m.group(), m.end()
+            if c == "\\":
+                i += 1
+            elif c == '"':
+                in_string = not in_string
+            elif not in_string:
+                depth += 1 if c == "{" else -1
+        yield text[match.end() : i - 1]
+
+
+def parse_terraform_references(
+    path: Path,
+    # No leading \b: patterns that start with a literal let the regex engine skip ahead quickly
+    backend_header: re.Pattern = re.compile(r'backend\s+"s3"\s*\{'),
+    remote_state_header: re.Pattern = re.compile(r'data\s+"terraform_remote_state"\s+"[^"]*"\s*\{'),
+    module_header: re.Pattern = re.compile(r'module\s+"[^"]*"\s*\{'),
+    key_attr: re.Pattern = re.compile(r'\bkey\s*=\s*"([^"$]+)"'),
+    source_attr: re.Pattern = re.compile(r'\bsource\s*=\s*"(\.\.?/[^"]*)"'),
+) -> TerraformReferences:
+    """Extract the references a directory's .tf files make to other Terraform code.
+
+    Collects the S3 backend state key the directory writes to, the state keys it reads
+    through `terraform_remote_state` data sources, and the sources of local modules
+    (`./` or `../` paths). Keys containing interpolations can't be resolved statically
+    and are ignored.
+    """
+    refs: TerraformReferences = {"backend_key": None, "remote_state_keys": [], "module_sources": []}
+    for tf_file in sorted(list_tf_files(path)):
+        try:
+            text = Path(tf_file).read_text(errors="replace")
+        except OSError:
+            continue
+        IO_COUNTERS["files_read"] += 1
+        IO_COUNTERS["bytes_read"] += len(text)
+        # Only files that may contain one of the blocks need their comments stripped
+        if "backend" not in text and "terraform_remote_state" not in text and "module" not in text:
+            continue
+        text = strip_hcl_comments(text)
+        for body in find_hcl_blocks(text, backend_header):
+            if m := key_attr.search(body):
+                refs["backend_key"] = m.group(1)
+        for body in find_hcl_blocks(text, remote_state_header):
+            refs["remote_state_keys"].extend(key_attr.findall(body))
+        for body in find_hcl_blocks(text, module_header):
+            refs["module_sources"].extend(source_attr.findall(body))
+    return refs
+
+
+def build_dependency_graph(
+    root: Path, stacks: list[str], references: dict[str, TerraformReferences] | None = None
+) -> dict[str, set[str]]:
+    """Map each stack to the stacks (within the given list) it depends on.
+
+    A stack depends on another if it reads its state through a `terraform_remote_state`
+    data source, or if it uses the other stack's directory as a local module. Parsed
+    references are stored in (and reused from) the references dict, if given.
+    """
+    if references is None:
+        references = {}
+    for stack in stacks:
+        if stack not in references:
+            references[stack] = parse_terraform_references(root / stack)
+    refs = {stack: references[stack] for stack in stacks}
+    stack_by_key = {r["backend_key"]: stack for stack, r in refs.items() if r["backend_key"]}
+
+    graph: dict[str, set[str]] = {}
+    for stack, r in refs.items():
+        deps = {stack_by_key[key] for key in r["remote_state_keys"] if key in stack_by_key}
+        for source in r["module_sources"]:
+            if (target := posixpath.normpath(posixpath.join(stack, source))) in refs:
+                deps.add(target)
+        deps.discard(stack)
+        graph[stack] = deps
+    return graph
+
+
+def resolve_local_modules(root: Path, directory: str) -> list[str]:
+    """Resolve the local module sources used in a directory to paths relative to root."""
+    modules = []
+    for source in parse_terraform_references(root / directory)["module_sources"]:
+        module = posixpath.normpath(posixpath.join(directory, source))
+        if module != ".." and not module.startswith("../"):
+            modules.append(module)
+    return modules
+
+
+def build_module_index(root: Path, stacks: Iterable[str]) -> dict[str, set[str]]:
+    """Map each local module directory to the stacks that use it, directly or through nested modules."""
+    modules_of: dict[str, list[str]] = {}
+    index: dict[str, set[str]] = {}
+    for stack in stacks:
+        seen = set()
+        pending = [stack]
+        while pending:
+            directory = pending.pop()
+            if directory not in modules_of:
+                modules_of[directory] = resolve_local_modules(root, directory)
+            for module in modules_of[directory]:
+                if module not in seen:
+                    seen.add(module)
+                    pending.append(module)
+        for module in seen:
+            index.setdefault(module, set()).add(stack)
+    return index
+
+
+def terraform_module_root(root: Path, directory: str) -> str | None:
+    """Return the closest of a directory and its ancestors below root with .tf files, if any."""
+    parts = directory.split("/")
+    for i in range(len(parts), 0, -1):
+        if list_tf_files(root.joinpath(*parts[:i])):
+            return "/".join(parts[:i])
+    return None
+
+
+def stacks_using_modules(module_index: dict[str, set[str]], dirs: Iterable[str]) -> set[str]:
+    """Find the stacks that use a module containing any of the given directories."""
+    stacks = set()
+    for directory in dirs:
+        parts = directory.split("/")
+        for i in range(len(parts), 0, -1):
+            stacks |= module_index.get("/".join(parts[:i]), set())
+    return stacks
+
+
+def dependency_waves(graph: dict[str, set[str]]) -> list[list[str]]:
+    """Group stacks into waves that can be deployed in parallel, in topological order.
+
+    Every stack is placed in the first wave after all of its dependencies. If the
+    dependencies contain a cycle, a warning is emitted and the stacks in (or depending
+    on) the cycle are placed together in a final wave.
+    """
+    remaining = {stack: set(deps) for stack, deps in graph.items()}
+    waves = []
+    while remaining:
+        wave = sorted(stack for stack, deps in remaining.items() if not deps)
+        if not wave:
+            wave = sorted(remaining)
+            eprint(f"::warning::Dependency cycle between stacks, deploying them in a single final wave: {wave}")
+            waves.append(wave)
+            break
+        for stack in wave:
+            del remaining[stack]
+        for deps in remaining.values():
+            deps.difference_update(wave)
+        waves.append(wave)
+    return waves
+
+
 def parse_string_list(s: str | None) -> list[str]:
     """Parse a comma-separated or newline-delimited string into a list."""
     if not s or not s.strip():
@@ -181,48 +845,143 @@ def parse_string_list(s: str | None) -> list[str]:
 
 def expand_patterns(patterns: list[str]) -> list[str]:
     """Expand braces in a list of patterns."""
-    return [expanded for p in patterns for expanded in expand_braces(p)]
+    return [expanded for p in patterns for expanded in iter_expand_braces(p)]
 
 
-def main(writer: TextIO = sys.stdout, root: Path = Path()) -> dict:
-    selected_stacks = expand_patterns(parse_string_list(os.environ.get("SELECTED_STACKS", "")))
-    ignored_stacks = expand_patterns(parse_string_list(os.environ.get("IGNORED_STACKS", "")))
-    core_stacks = expand_patterns(parse_string_list(os.environ.get("CORE_STACKS", "")))
-    additional_core_stacks = expand_patterns(parse_string_list(os.environ.get("ADDITIONAL_CORE_STACKS", "")))
-    changed_files = parse_string_list(os.environ.get("CHANGED_FILES", ""))
-
-    if selected_stacks:
-        # If stacks are explicitly selected, use those
-        dirs = get_dirs_from_glob(root, selected_stacks)
-    else:
-        # We use changed files if no stacks are explicitly selected
-        dirs = files_to_dirs(changed_files)
+class Profiler:
+    """Opt-in wall time, item count and file I/O accounting for the phases of main()."""
 
-    # Filter to valid Terraform stacks and exclude any that match ignored patterns
-    terraform_dirs = [d for d in dirs if is_terraform_stack(root / d)]
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.phases: list[dict] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[dict]:
+        """Time a phase. The caller may set "items" on the yielded record."""
+        record = {"phase": name, "items": None}
+        if not self.enabled:
+            yield record
+            return
+        files_read, bytes_read = IO_COUNTERS["files_read"], IO_COUNTERS["bytes_read"]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            record["files_read"] = IO_COUNTERS["files_read"] - files_read
+            record["bytes_read"] = IO_COUNTERS["bytes_read"] - bytes_read
+            self.phases.append(record)
+
+    def report(self, summary_file: str | None = None) -> None:
+        """Write the recorded phases as JSON to stderr and as a markdown table to summary_file."""
+        if not self.enabled:
+            return
+        total = round(sum(p["seconds"] for p in self.phases), 6)
+        eprint(json.dumps({"phases": self.phases, "total_seconds": total}))
+        if not summary_file:
+            return
+        lines = [
+            "### determine-stacks profile",
+            "",
+            "| Phase | Time (ms) | Items | Files read |",
+            "|-------|----------:|------:|-----------:|",
+        ]
+        for p in self.phases:
+            items = "" if p["items"] is None else p["items"]
+            lines.append(f"| {p['phase']} | {p['seconds'] * 1000:.1f} | {items} | {p['files_read']} |")
+        lines.append(f"| **total** | {total * 1000:.1f} | | |")
+        with open(summary_file, "a") as f:
+            f.write("\n".join(lines) + "\n\n")
+
+
+def read_changed_dirs(root: Path) -> list[str]:
+    """Directories with changed files, from CHANGED_FILES_FILE, a git diff or CHANGED_FILES."""
+    changed_files_file = os.environ.get("CHANGED_FILES_FILE", "")
+    if changed_files_file:
+        # Stream changed files from a file (or stdin) to avoid holding the full list in memory
+        source = nullcontext(sys.stdin.buffer) if changed_files_file == "-" else open(changed_files_file, "rb")
+        with source as stream:
+            return files_to_dirs(iter_path_list(stream))
+    if base_ref := os.environ.get("BASE_REF", ""):
+        # Diff the local checkout instead of relying on a list from the GitHub API
+        return files_to_dirs(git_changed_files(root, base_ref, os.environ.get("HEAD_REF", "") or "HEAD"))
+    return files_to_dirs(parse_string_list(os.environ.get("CHANGED_FILES", "")))
+
+
+def expand_module_changes(
+    root: Path,
+    dirs: list[str],
+    stack_index: set[str],
+    skipped_dirs: frozenset[str],
+    cache: StackCache | None = None,
+) -> list[str]:
+    """Add the stacks that use changed shared modules to dirs (and stack_index).
+
+    Changes to shared local modules affect every stack that uses them. Only build the
+    (repository-wide) module index if a changed directory could be part of a module:
+    changes to files of a stack itself, like templates in a subdirectory without .tf files,
+    don't need it.
+    """
+    module_roots = {}
+    for d in dirs:
+        if d not in stack_index and (module_root := terraform_module_root(root, d)) is not None:
+            module_roots[d] = module_root
+    stack_roots = {r for r in module_roots.values() if r in stack_index}
+    if unknown_roots := set(module_roots.values()) - stack_roots:
+        stack_roots |= build_stack_index(root, sorted(unknown_roots), cache=cache)
+    module_dirs = [d for d, module_root in module_roots.items() if module_root not in stack_roots]
+    if not module_dirs:
+        return dirs
+    module_index = build_module_index(root, build_stack_index(root, skipped_dirs=skipped_dirs, cache=cache))
+    if affected := stacks_using_modules(module_index, module_dirs) - set(dirs):
+        eprint(f"Added stacks using changed modules: {sorted(affected)}")
+        stack_index |= affected
+        dirs = sorted(set(dirs) | affected)
+    return dirs
+
+
+def select_stacks(
+    root: Path,
+    dirs: list[str],
+    stack_index: set[str],
+    ignored_matcher: PatternMatcher,
+    core_matcher: PatternMatcher,
+    profiler: Profiler,
+    references: dict[str, TerraformReferences] | None = None,
+    label: str = "",
+    waves: bool = False,
+) -> dict:
+    """Filter candidate directories down to stacks and group them into the action outputs.
+
+    label prefixes the profiled phase names, to tell configurations apart in batch mode.
+    The dev-waves and prod-waves outputs are only computed (reading the stacks' .tf
+    files) if waves is set.
+    """
+    terraform_dirs = [d for d in dirs if d in stack_index]
 
     if non_terraform_dirs := sorted(set(dirs) - set(terraform_dirs)):
         eprint(f"Skipped non-Terraform directories: {non_terraform_dirs}")
 
     # Filter out valid, but ignored stacks
-    included_dirs = [
-        d
-        for d in terraform_dirs
-        if not any(PurePosixPath(d).full_match(pattern) for pattern in ignored_stacks)
-    ]
+    with profiler.phase(f"{label}filter ignored") as phase:
+        included_dirs = [d for d in terraform_dirs if not ignored_matcher.matches(d)]
+        phase["items"] = len(included_dirs)
 
     if ignored_dirs := sorted(set(terraform_dirs) - set(included_dirs)):
         eprint(f"Skipped ignored directories: {ignored_dirs}")
 
     # Separate by environment
-    dev_dirs, prod_dirs, unknown = separate_by_environment(included_dirs)
+    with profiler.phase(f"{label}separate environments") as phase:
+        dev_dirs, prod_dirs, unknown = separate_by_environment(included_dirs)
+        phase["items"] = len(dev_dirs) + len(prod_dirs)
     if unknown:
         eprint(f"Skipped stacks with unknown environment: {sorted(unknown)}")
 
     # Classify into core and apps
-    result_core_stacks = core_stacks + additional_core_stacks
-    dev_core_stacks, dev_apps_stacks = classify_stacks(dev_dirs, result_core_stacks)
-    prod_core_stacks, prod_apps_stacks = classify_stacks(prod_dirs, result_core_stacks)
+    with profiler.phase(f"{label}classify") as phase:
+        dev_core_stacks, dev_apps_stacks = classify_stacks(dev_dirs, core_matcher)
+        prod_core_stacks, prod_apps_stacks = classify_stacks(prod_dirs, core_matcher)
+        phase["items"] = len(dev_core_stacks) + len(prod_core_stacks)
 
     # Combine results for convenience use
     all_dev_stacks = sorted(dev_core_stacks + dev_apps_stacks)
@@ -239,13 +998,199 @@ def main(writer: TextIO = sys.stdout, root: Path = Path()) -> dict:
         "all-stacks": all_stacks,
     }
 
+    if waves:
+        # Group stacks into parallel deployment waves based on their dependencies
+        with profiler.phase(f"{label}dependency waves") as phase:
+            result["dev-waves"] = dependency_waves(build_dependency_graph(root, dev_dirs, references))
+            result["prod-waves"] = dependency_waves(build_dependency_graph(root, prod_dirs, references))
+            phase["items"] = len(result["dev-waves"]) + len(result["prod-waves"])
+
+    return result
+
+
+def read_common_settings(root: Path) -> tuple[StackCache | None, frozenset[str]]:
+    """The stack cache and skipped directories shared by main() and batch_main()."""
+    cache_file = os.environ.get("STACK_CACHE_FILE", "")
+    cache = StackCache(Path(cache_file), root) if cache_file else None
+    skipped_dirs = os.environ.get("SKIPPED_DIRECTORIES")
+    skipped_dirs = DEFAULT_SKIPPED_DIRECTORIES if skipped_dirs is None else frozenset(parse_string_list(skipped_dirs))
+    return cache, skipped_dirs
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get("DETERMINE_STACKS_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+def waves_enabled() -> bool:
+    return os.environ.get("DEPENDENCY_WAVES", "").lower() in ("1", "true", "yes")
+
+
+def main(writer: TextIO = sys.stdout, root: Path = Path()) -> dict:
+    if os.environ.get("BATCH_CONFIGS", "").strip():
+        return batch_main(writer, root)
+
+    profiler = Profiler(profiling_enabled())
+
+    with profiler.phase("parse patterns") as phase:
+        # Braces are compiled into the matchers rather than expanded into separate patterns
+        selected_stacks = parse_string_list(os.environ.get("SELECTED_STACKS", ""))
+        ignored_stacks = parse_string_list(os.environ.get("IGNORED_STACKS", ""))
+        core_stacks = parse_string_list(os.environ.get("CORE_STACKS", ""))
+        additional_core_stacks = parse_string_list(os.environ.get("ADDITIONAL_CORE_STACKS", ""))
+        for pattern in selected_stacks:
+            validate_braces(pattern)
+        ignored_matcher = PatternMatcher(ignored_stacks)
+        core_matcher = PatternMatcher(core_stacks + additional_core_stacks)
+        cache, skipped_dirs = read_common_settings(root)
+        phase["items"] = len(selected_stacks) + len(ignored_stacks) + len(core_stacks) + len(additional_core_stacks)
+
+    with profiler.phase("collect candidates") as phase:
+        if selected_stacks:
+            # If stacks are explicitly selected, use those
+            dirs = get_dirs_from_glob(root, selected_stacks, skipped_dirs)
+        else:
+            # We use changed files if no stacks are explicitly selected
+            dirs = read_changed_dirs(root)
+        phase["items"] = len(dirs)
+
+    # Filter to valid Terraform stacks and exclude any that match ignored patterns
+    with profiler.phase("detect stacks") as phase:
+        stack_index = build_stack_index(root, dirs, cache=cache)
+        phase["items"] = len(stack_index)
+
+    with profiler.phase("expand module changes") as phase:
+        if not selected_stacks:
+            candidates = len(dirs)
+            dirs = expand_module_changes(root, dirs, stack_index, skipped_dirs, cache)
+            phase["items"] = len(dirs) - candidates
+
+    if cache:
+        cache.save()
+
+    result = select_stacks(root, dirs, stack_index, ignored_matcher, core_matcher, profiler, waves=waves_enabled())
+
     if writer:
         # Write outputs in GitHub Actions format
         for key, value in result.items():
             writer.write(f"{key}={json.dumps(value)}\n")
 
+    profiler.report(os.environ.get("GITHUB_STEP_SUMMARY"))
+
     return result
 
 
+BatchConfig = TypedDict(
+    "BatchConfig",
+    {
+        "name": str,
+        "selected-stacks": str | list[str],
+        "ignored-stacks": str | list[str],
+        "core-stacks": str | list[str],
+        "additional-core-stacks": str | list[str],
+    },
+    total=False,
+)
+
+BATCH_PATTERN_KEYS = {
+    "selected-stacks": "SELECTED_STACKS",
+    "ignored-stacks": "IGNORED_STACKS",
+    "core-stacks": "CORE_STACKS",
+    "additional-core-stacks": "ADDITIONAL_CORE_STACKS",
+}
+
+
+def parse_batch_configs(text: str) -> list[BatchConfig]:
+    """Parse and validate a JSON array of named filter configurations."""
+    configs = json.loads(text)
+    if not isinstance(configs, list):
+        raise ValueError("Batch configurations must be a JSON array")
+    names = set()
+    for config in configs:
+        if not isinstance(config, dict) or not isinstance(config.get("name"), str) or not config["name"]:
+            raise ValueError(f"Batch configuration must be an object with a non-empty name: {config!r}")
+        if config["name"] in names:
+            raise ValueError(f"Duplicate batch configuration name: {config['name']!r}")
+        names.add(config["name"])
+        if unknown := set(config) - {"name", *BATCH_PATTERN_KEYS}:
+            raise ValueError(f"Unknown keys in batch configuration {config['name']!r}: {sorted(unknown)}")
+        for key in BATCH_PATTERN_KEYS:
+            value = config.get(key, "")
+            if not isinstance(value, str) and not (
+                isinstance(value, list) and all(isinstance(v, str) for v in value)
+            ):
+                raise ValueError(f"{key} in batch configuration {config['name']!r} must be a string or list of strings")
+    return configs
+
+
+def batch_patterns(config: BatchConfig, key: str) -> list[str]:
+    """Patterns for key in config, falling back to the corresponding environment variable."""
+    value = config.get(key, os.environ.get(BATCH_PATTERN_KEYS[key], ""))
+    return parse_string_list(value if isinstance(value, str) else ",".join(value))
+
+
+def batch_main(writer: TextIO = sys.stdout, root: Path = Path()) -> dict:
+    """Evaluate every configuration in BATCH_CONFIGS against a single scan of the repository.
+
+    The glob walk for all selected-stacks patterns, the changed-file list, stack detection
+    and Terraform reference parsing are shared between configurations. Results are written
+    as a single batch-results output, keyed by configuration name.
+    """
+    if not os.environ.get("BATCH_CONFIGS", "").strip():
+        sys.exit("::error::BATCH_CONFIGS must be set to a JSON array of batch configurations")
+
+    profiler = Profiler(profiling_enabled())
+
+    with profiler.phase("parse patterns") as phase:
+        configs = parse_batch_configs(os.environ["BATCH_CONFIGS"])
+        selected = [batch_patterns(config, "selected-stacks") for config in configs]
+        for pattern in itertools.chain.from_iterable(selected):
+            validate_braces(pattern)
+        ignored_matchers = [PatternMatcher(batch_patterns(config, "ignored-stacks")) for config in configs]
+        core_matchers = [
+            PatternMatcher(batch_patterns(config, "core-stacks") + batch_patterns(config, "additional-core-stacks"))
+            for config in configs
+        ]
+        cache, skipped_dirs = read_common_settings(root)
+        phase["items"] = len(configs)
+
+    with profiler.phase("collect candidates") as phase:
+        # One walk for the selected-stacks patterns of all configurations
+        globbed = iter(get_dirs_from_glob_groups(root, [s for s in selected if s], skipped_dirs))
+        changed_dirs = None if all(selected) else read_changed_dirs(root)
+        dirs = [next(globbed) if s else changed_dirs for s in selected]
+        candidates = set(itertools.chain.from_iterable(dirs))
+        phase["items"] = len(candidates)
+
+    with profiler.phase("detect stacks") as phase:
+        stack_index = build_stack_index(root, sorted(candidates), cache=cache)
+        phase["items"] = len(stack_index)
+
+    with profiler.phase("expand module changes") as phase:
+        if changed_dirs is not None:
+            expanded = expand_module_changes(root, changed_dirs, stack_index, skipped_dirs, cache)
+            dirs = [expanded if d is changed_dirs else d for d in dirs]
+            phase["items"] = len(expanded) - len(changed_dirs)
+
+    if cache:
+        cache.save()
+
+    references: dict[str, TerraformReferences] = {}
+    waves = waves_enabled()
+    results = {}
+    for config, config_dirs, ignored_matcher, core_matcher in zip(configs, dirs, ignored_matchers, core_matchers):
+        eprint(f"Configuration {config['name']!r}:")
+        label = f"{config['name']}: "
+        results[config["name"]] = select_stacks(
+            root, config_dirs, stack_index, ignored_matcher, core_matcher, profiler, references, label, waves
+        )
+
+    if writer:
+        writer.write(f"batch-results={json.dumps(results)}\n")
+
+    profiler.report(os.environ.get("GITHUB_STEP_SUMMARY"))
+
+    return results
+
+
 if __name__ == "__main__":
     main()
@@ -3,22 +3,42 @@
 import io
 import json
 import os
+import shutil
+import subprocess
 import sys
-from pathlib import Path
+import threading
+from pathlib import Path, PurePosixPath
+from unittest import mock
 
 import pytest
 
 sys.path.insert(0, str(Path(__file__).parent))
 
 from determine_stacks import (
+    batch_main,
+    build_dependency_graph,
+    build_module_index,
+    build_stack_index,
     classify_stacks,
+    dependency_waves,
     determine_stack_environment,
     expand_braces,
+    file_contains,
     files_to_dirs,
+    get_dirs_from_glob,
+    get_dirs_from_glob_groups,
+    git_changed_files,
     is_terraform_stack,
+    iter_expand_braces,
+    iter_path_list,
     main,
+    parent_dir,
+    parse_batch_configs,
     parse_string_list,
+    parse_terraform_references,
+    PatternMatcher,
     separate_by_environment,
+    StackCache,
 )
 
 
@@ -46,22 +66,54 @@ def _to_str(value: list[str] | str) -> str:
     return value
 
 
+# Every environment variable read by main() and batch_main()
+ACTION_ENV_VARS = (
+    "CHANGED_FILES",
+    "CHANGED_FILES_FILE",
+    "SELECTED_STACKS",
+    "IGNORED_STACKS",
+    "CORE_STACKS",
+    "ADDITIONAL_CORE_STACKS",
+    "BASE_REF",
+    "HEAD_REF",
+    "STACK_CACHE_FILE",
+    "SKIPPED_DIRECTORIES",
+    "DETERMINE_STACKS_PROFILE",
+    "DEPENDENCY_WAVES",
+    "BATCH_CONFIGS",
+    "GITHUB_STEP_SUMMARY",
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_environment(monkeypatch):
+    """Start every test without inputs from the environment (or from other tests)."""
+    for var in ACTION_ENV_VARS:
+        monkeypatch.delenv(var, raising=False)
+
+
 def run_main(
     changed_files: list[str] | str = "",
     selected_stacks: list[str] | str = "",
     ignored_stacks: list[str] | str = "",
     core_stacks: list[str] | str = DEFAULT_CORE_STACKS,
     additional_core_stacks: list[str] | str = "",
+    changed_files_file: str = "",
+    root: Path = Path("testdata"),
 ):
     """Helper to run the main function with test parameters."""
-    os.environ["CHANGED_FILES"] = _to_str(changed_files)
-    os.environ["SELECTED_STACKS"] = _to_str(selected_stacks)
-    os.environ["IGNORED_STACKS"] = _to_str(ignored_stacks)
-    os.environ["CORE_STACKS"] = _to_str(core_stacks)
-    os.environ["ADDITIONAL_CORE_STACKS"] = _to_str(additional_core_stacks)
+    env = {
+        "CHANGED_FILES": _to_str(changed_files),
+        "CHANGED_FILES_FILE": changed_files_file,
+        "SELECTED_STACKS": _to_str(selected_stacks),
+        "IGNORED_STACKS": _to_str(ignored_stacks),
+        "CORE_STACKS": _to_str(core_stacks),
+        "ADDITIONAL_CORE_STACKS": _to_str(additional_core_stacks),
+    }
 
     writer = io.StringIO()
-    main(writer, Path("testdata"))
+    with mock.patch.dict(os.environ, env):
+        main(writer, root)
 
     result = {}
     for line in writer.getvalue().strip().split("\n"):
@@ -151,6 +203,15 @@ def test_expand_braces_invalid_syntax():
         expand_braces("{a,,b}")  # empty alternative
 
 
+def test_iter_expand_braces_is_lazy():
+    """Expansions are generated on demand, in the same order as expand_braces."""
+    pattern = "{a,b,c}/{dev,qa,test,prod}/{x,y,z,w}/**"
+    expansions = iter_expand_braces(pattern)
+    assert next(expansions) == "a/dev/x/**"
+    assert [next(expansions) for _ in range(3)] == ["a/dev/y/**", "a/dev/z/**", "a/dev/w/**"]
+    assert list(iter_expand_braces(pattern)) == expand_braces(pattern)
+
+
 # =============================================================================
 # determine_stack_environment() tests
 # =============================================================================
@@ -208,6 +269,208 @@ def test_is_terraform_stack():
     assert is_terraform_stack(root / "stacks/dev/nonexistent") is False
 
 
+def test_file_contains_across_chunk_boundary(tmp_path):
+    """Needles split across read chunks are still found."""
+    tf_file = tmp_path / "main.tf"
+    tf_file.write_text("x" * 10 + 'backend "s3" {}')
+    for chunk_size in (1, 4, 11, 12, 1024):
+        assert file_contains(tf_file, b'backend "s3"', chunk_size=chunk_size) is True
+    assert file_contains(tf_file, b'backend "gcs"', chunk_size=4) is False
+
+
+# =============================================================================
+# build_stack_index() tests
+# =============================================================================
+
+
+def test_build_stack_index_walks_tree():
+    """A full walk finds every stack under root, including nested ones."""
+    index = build_stack_index(Path("testdata"))
+    assert "stacks/dev/networking" in index
+    assert "stacks/prod/applications/app-deep" in index
+    assert "stacks/dev/backup/bin" not in index
+    assert "stacks/prod/applications" not in index
+
+
+def test_build_stack_index_candidates():
+    """Only the given candidate directories are checked."""
+    index = build_stack_index(
+        Path("testdata"),
+        ["stacks/dev/networking", "stacks/dev/backup/bin", "stacks/dev/nonexistent"],
+    )
+    assert index == {"stacks/dev/networking"}
+
+
+def test_build_stack_index_skips_heavy_dirs(tmp_path):
+    """Directories such as .terraform are never descended into."""
+    for d in ("stack", ".terraform/modules/vendored"):
+        (tmp_path / d).mkdir(parents=True)
+        (tmp_path / d / "main.tf").write_text('backend "s3" {}')
+    assert build_stack_index(tmp_path) == {"stack"}
+
+
+# =============================================================================
+# StackCache tests
+# =============================================================================
+
+
+def test_stack_cache_reuses_unchanged_dirs(tmp_path):
+    """Unchanged directories are answered from the cache; changed ones are rescanned."""
+    repo = tmp_path / "repo"
+    for stack in ("stacks/dev/a", "stacks/dev/b"):
+        (repo / stack).mkdir(parents=True)
+        (repo / stack / "main.tf").write_text('backend "s3" {}')
+    cache_file = tmp_path / "cache" / "stacks.json"
+
+    cache = StackCache(cache_file, repo)
+    assert build_stack_index(repo, cache=cache) == {"stacks/dev/a", "stacks/dev/b"}
+    assert (cache.hits, cache.misses) == (0, 2)
+    cache.save()
+
+    (repo / "stacks/dev/b/main.tf").write_text('backend "local" {}')
+    cache = StackCache(cache_file, repo)
+    assert build_stack_index(repo, ["stacks/dev/a", "stacks/dev/b"], cache=cache) == {"stacks/dev/a"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stack_cache_uses_git_blob_ids(tmp_path):
+    """Tracked files are fingerprinted by content, so a fresh checkout still hits."""
+    (tmp_path / "stack").mkdir()
+    (tmp_path / "stack/main.tf").write_text('backend "s3" {}')
+    subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+    subprocess.run(["git", "add", "."], cwd=tmp_path, check=True)
+    cache_file = tmp_path / "cache.json"
+
+    cache = StackCache(cache_file, tmp_path)
+    assert build_stack_index(tmp_path, ["stack"], cache=cache) == {"stack"}
+    cache.save()
+
+    os.utime(tmp_path / "stack/main.tf", (0, 0))
+    cache = StackCache(cache_file, tmp_path)
+    assert build_stack_index(tmp_path, ["stack"], cache=cache) == {"stack"}
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_stack_cache_prunes_deleted_dirs(tmp_path):
+    """Entries for directories that no longer exist are dropped when the cache is saved."""
+    repo = tmp_path / "repo"
+    for stack in ("stacks/dev/a", "stacks/dev/b"):
+        (repo / stack).mkdir(parents=True)
+        (repo / stack / "main.tf").write_text('backend "s3" {}')
+    cache_file = tmp_path / "cache.json"
+
+    cache = StackCache(cache_file, repo)
+    build_stack_index(repo, cache=cache)
+    cache.save()
+
+    shutil.rmtree(repo / "stacks/dev/b")
+    cache = StackCache(cache_file, repo)
+    assert build_stack_index(repo, ["stacks/dev/a"], cache=cache) == {"stacks/dev/a"}
+    cache.save()
+    assert json.loads(cache_file.read_text())["entries"] == {"stacks/dev/a": [mock.ANY, True]}
+
+
+def test_stack_cache_ignores_corrupt_file(tmp_path, capsys):
+    """A corrupt cache file is treated as empty."""
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text("not json")
+    cache = StackCache(cache_file, tmp_path)
+    assert build_stack_index(Path("testdata"), ["stacks/dev/iam"], cache=cache) == {"stacks/dev/iam"}
+    assert cache.misses == 1
+    assert "Ignoring unreadable stack cache" in capsys.readouterr().err
+
+
+def test_stack_cache_drops_malformed_entries(tmp_path):
+    """Malformed entries are rescanned, and valid ones are still used."""
+    cache_file = tmp_path / "cache.json"
+    cache = StackCache(cache_file, Path("testdata"))
+    build_stack_index(Path("testdata"), ["stacks/dev/iam"], cache=cache)
+    fingerprint, is_stack = cache._entries["stacks/dev/iam"]
+    entries = {
+        "stacks/dev/iam": [fingerprint, is_stack],
+        "stacks/dev/networking": "abc",
+        "stacks/prod/dns": [],
+        "stacks/prod/app-hello": {"fingerprint": "abc"},
+        "stacks/dev/app-too-tikki": [None, True, "dev"],
+    }
+    cache_file.write_text(json.dumps({"version": StackCache.VERSION, "entries": entries}))
+
+    cache = StackCache(cache_file, Path("testdata"))
+    assert build_stack_index(Path("testdata"), list(entries), cache=cache) == set(entries)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_stack_cache_ignores_entries_of_wrong_type(tmp_path, capsys):
+    """A cache whose entries aren't an object is treated as empty."""
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text(json.dumps({"version": StackCache.VERSION, "entries": [["abc", True]]}))
+    cache = StackCache(cache_file, Path("testdata"))
+    assert build_stack_index(Path("testdata"), ["stacks/dev/iam"], cache=cache) == {"stacks/dev/iam"}
+    assert "Ignoring unreadable stack cache" in capsys.readouterr().err
+
+
+# =============================================================================
+# get_dirs_from_glob() tests
+# =============================================================================
+
+
+def test_get_dirs_from_glob_multiple_patterns():
+    """All patterns are matched in one walk; files map to their parent directory."""
+    dirs = get_dirs_from_glob(
+        Path("testdata"), ["stacks/dev/app-*", "**/applications/*/main.tf", "stacks/*/dns"]
+    )
+    assert dirs == [
+        "stacks/dev/app-custom",
+        "stacks/dev/app-too-tikki",
+        "stacks/prod/applications/app-deep",
+        "stacks/prod/dns",
+    ]
+
+
+def test_get_dirs_from_glob_braces():
+    """Brace groups match within a segment and across segments."""
+    root = Path("testdata")
+    assert get_dirs_from_glob(root, ["stacks/{dev,prod}/{dns,iam}"]) == [
+        "stacks/dev/iam",
+        "stacks/prod/dns",
+    ]
+    assert get_dirs_from_glob(root, ["{stacks/dev/backup,stacks/prod/applications}/*"]) == [
+        "stacks/dev/backup/bin",
+        "stacks/prod/applications/app-deep",
+    ]
+
+
+def test_get_dirs_from_glob_double_star_includes_start():
+    """A trailing ** matches the directory itself and everything below it."""
+    dirs = get_dirs_from_glob(Path("testdata"), ["stacks/dev/backup/**"])
+    assert dirs == ["stacks/dev/backup", "stacks/dev/backup/bin"]
+
+
+def test_get_dirs_from_glob_trailing_double_star_skips_files(tmp_path):
+    """Like Path.glob, a trailing ** doesn't match files, even when it matches zero segments."""
+    for d in ("a/x/y", "c.tf"):
+        (tmp_path / d).mkdir(parents=True)
+    for f in ("a/main.tf", "a/x/main.tf", "b/main.tf"):
+        (tmp_path / f).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / f).write_text("")
+
+    assert get_dirs_from_glob(tmp_path, ["{a,b}/*/**"]) == ["a/x", "a/x/y"]
+    assert get_dirs_from_glob(tmp_path, ["*/*.tf/**"]) == []
+    for pattern in ("*/**", "*/*/**", "*.tf/**", "**/*.tf", "a/**/main.tf"):
+        expected = {p if p.is_dir() else p.parent for p in tmp_path.glob(pattern)}
+        assert get_dirs_from_glob(tmp_path, [pattern]) == sorted(
+            p.relative_to(tmp_path).as_posix() for p in expected
+        ), pattern
+
+
+def test_get_dirs_from_glob_skipped_dirs(tmp_path):
+    """Skipped directories are never searched."""
+    for d in ("stacks/dev/app", "stacks/dev/app/.terraform/modules/x", "node_modules/pkg"):
+        (tmp_path / d).mkdir(parents=True)
+    assert get_dirs_from_glob(tmp_path, ["**"]) == [".", "stacks", "stacks/dev", "stacks/dev/app"]
+    assert "node_modules/pkg" in get_dirs_from_glob(tmp_path, ["**"], skipped_dirs=frozenset())
+
+
 # =============================================================================
 # files_to_dirs() tests
 # =============================================================================
@@ -235,6 +498,152 @@ def test_files_to_dirs_boilerplate():
     assert files_to_dirs(files) == ["stacks/dev/app"]
 
 
+def test_files_to_dirs_generator():
+    """Any iterable of paths is accepted, including generators."""
+    files = (f"stacks/dev/app/file-{i}.tf" for i in range(1000))
+    assert files_to_dirs(files) == ["stacks/dev/app"]
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "main.tf",
+        ".boilerplate/x",
+        "stacks/dev/app/.boilerplate/x",
+        "./stacks//dev/./app/main.tf",
+        "/stacks/dev/main.tf",
+        "stacks/dev/app/",
+        "stacks/dev/app/.",
+        "stacks/../app/main.tf",
+        "",
+    ],
+)
+def test_parent_dir_matches_pure_path(path):
+    """parent_dir() gives the same result as PurePosixPath, including for unnormalized paths."""
+    parent = PurePosixPath(path).parent
+    if parent.name == ".boilerplate":
+        parent = parent.parent
+    assert parent_dir(path) == str(parent)
+
+
+# =============================================================================
+# iter_path_list() tests
+# =============================================================================
+
+
+def test_iter_path_list_nul_delimited():
+    """NUL-delimited input is split on NUL, even across chunk boundaries."""
+    stream = io.BytesIO(b"stacks/dev/a b/main.tf\0stacks/prod/dns/main.tf\0")
+    assert list(iter_path_list(stream, chunk_size=5)) == [
+        "stacks/dev/a b/main.tf",
+        "stacks/prod/dns/main.tf",
+    ]
+
+
+def test_iter_path_list_newline_delimited():
+    """Newline-delimited input skips blank lines and drops carriage returns."""
+    stream = io.BytesIO(b"stacks/dev/app/main.tf\r\n\n \nstacks/prod/dns/main.tf\r")
+    assert list(iter_path_list(stream, chunk_size=4)) == [
+        "stacks/dev/app/main.tf",
+        "stacks/prod/dns/main.tf",
+    ]
+
+
+def test_iter_path_list_keeps_surrounding_spaces():
+    """Paths that start or end with spaces are yielded unchanged."""
+    for delimiter in (b"\0", b"\n"):
+        stream = io.BytesIO(delimiter.join([b" stacks/dev/app/main.tf", b"stacks/dev/new /main.tf "]))
+        assert list(iter_path_list(stream, chunk_size=3)) == [" stacks/dev/app/main.tf", "stacks/dev/new /main.tf "]
+
+
+# =============================================================================
+# git_changed_files() tests
+# =============================================================================
+
+
+def _git(root: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def _git_repo(root: Path) -> None:
+    """Create a repository with a main branch and a feature branch checked out."""
+    _git(root, "init", "-q", "-b", "main")
+    _write_stack(root, "stacks/dev/app")
+    _write_stack(root, "stacks/dev/old-name")
+    _write_stack(root, "stacks/prod/dns")
+    _git(root, "add", ".")
+    _git(root, "commit", "-q", "-m", "initial")
+    _git(root, "checkout", "-q", "-b", "feature")
+    (root / "stacks/dev/app/variables.tf").write_text('variable "x" {}\n')
+    _git(root, "mv", "stacks/dev/old-name", "stacks/dev/new name")
+    _git(root, "add", ".")
+    _git(root, "commit", "-q", "-m", "feature")
+    # A later change on main isn't part of the feature branch's diff
+    _git(root, "checkout", "-q", "main")
+    (root / "stacks/prod/dns/extra.tf").write_text("")
+    _git(root, "add", ".")
+    _git(root, "commit", "-q", "-m", "main")
+    _git(root, "checkout", "-q", "feature")
+
+
+def test_git_changed_files(tmp_path):
+    """Changed files are listed from the merge base, with both sides of renames."""
+    _git_repo(tmp_path)
+    assert sorted(git_changed_files(tmp_path, "main")) == [
+        "stacks/dev/app/variables.tf",
+        "stacks/dev/new name/main.tf",
+        "stacks/dev/old-name/main.tf",
+    ]
+    assert sorted(git_changed_files(tmp_path / "stacks/dev", "main")) == [
+        "app/variables.tf",
+        "new name/main.tf",
+        "old-name/main.tf",
+    ]
+
+
+def test_git_changed_files_large_stderr(tmp_path, monkeypatch):
+    """Lots of warnings from git don't block reading the changed files."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "git").write_text(
+        "#!/bin/sh\n"
+        "yes 'warning: something' | head -c 1000000 >&2\n"
+        "printf 'stacks/dev/app/main.tf\\0'\n"
+    )
+    (bin_dir / "git").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    # A daemon thread, so a blocked git can't hang the test run
+    result = []
+    thread = threading.Thread(target=lambda: result.extend(git_changed_files(tmp_path, "main")), daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert result == ["stacks/dev/app/main.tf"]
+
+
+def test_git_changed_files_unknown_ref(tmp_path):
+    """A missing base ref (e.g. in a shallow clone) is reported as an error."""
+    _git_repo(tmp_path)
+    with pytest.raises(RuntimeError, match="between origin/main and HEAD"):
+        list(git_changed_files(tmp_path, "origin/main"))
+
+
+def test_main_with_base_ref(tmp_path, monkeypatch):
+    """main() detects changed stacks from the local checkout when BASE_REF is set."""
+    _git_repo(tmp_path)
+    monkeypatch.setenv("BASE_REF", "main")
+    monkeypatch.setenv("CORE_STACKS", "")
+    result = main(None, tmp_path)
+
+    assert result["all-stacks"] == ["stacks/dev/app", "stacks/dev/new name"]
+
+
 # =============================================================================
 # separate_by_environment() tests
 # =============================================================================
@@ -254,6 +663,63 @@ def test_separate_by_environment():
 # =============================================================================
 
 
+def test_pattern_matcher_first_match_wins():
+    """The index of the first matching pattern is returned."""
+    matcher = PatternMatcher(["**/networking-data", "**/networking", "**/*-data"])
+    assert matcher.match("stacks/dev/networking-data") == 0
+    assert matcher.match("stacks/dev/networking") == 1
+    assert matcher.match("stacks/dev/foo-data") == 2
+    assert matcher.match("stacks/dev/app") is None
+
+
+def test_pattern_matcher_full_match_semantics():
+    """Wildcards follow PurePosixPath.full_match semantics."""
+    assert PatternMatcher(["*"]).matches("stacks") is True
+    assert PatternMatcher(["*"]).matches("stacks/dev") is False
+    assert PatternMatcher(["**/prod/**"]).matches("prod/my-stack") is True
+    assert PatternMatcher(["stacks/prod/**"]).matches("stacks/prod") is False
+    assert PatternMatcher(["stacks/prod/**"]).matches("stacks/prod/a/b") is True
+    assert PatternMatcher(["stacks/?ev/[!x]pp"]).matches("stacks/dev/app") is True
+    assert PatternMatcher(["stacks/dev"]).matches("stacks/dev-tools") is False
+
+
+def test_pattern_matcher_braces():
+    """Brace alternatives map back to the pattern they came from."""
+    matcher = PatternMatcher(["**/iam", "**/{dev,prod}/app-*"])
+    assert matcher.match("stacks/prod/app-hello") == 1
+    assert matcher.match("stacks/test/app-hello") is None
+
+
+def test_pattern_matcher_braces_without_expansion():
+    """Brace groups are compiled into alternations instead of separate patterns."""
+    matcher = PatternMatcher(["{a,b,c}/{dev,qa,test,prod}/{x,y,z,w}/**", "**"])
+    assert len(matcher.patterns) == 2
+    assert matcher.match("c/qa/w/app") == 0
+    assert matcher.match("c/staging/w/app") == 1
+
+
+def test_pattern_matcher_braces_spanning_segments():
+    """Alternatives containing separators or ** keep literal expansion semantics."""
+    matcher = PatternMatcher(["{stacks/dev,apps}/dns", "x/{**,y}/z"])
+    assert matcher.match("stacks/dev/dns") == 0
+    assert matcher.match("apps/dns") == 0
+    assert matcher.match("stacks/dns") is None
+    assert matcher.match("x/a/b/z") == 1
+    assert matcher.match("x/z") == 1
+
+
+def test_pattern_matcher_invalid_braces():
+    """Invalid brace syntax raises the same errors as expand_braces."""
+    for pattern in ["{a,b", "a,b}", "{a,{b,c}}", "stacks/{}/app", "{a,,b}"]:
+        with pytest.raises(ValueError):
+            PatternMatcher([pattern])
+
+
+def test_pattern_matcher_empty():
+    """An empty pattern list never matches."""
+    assert PatternMatcher([]).match("stacks/dev/app") is None
+
+
 def test_classify_stacks():
     """Stacks are classified into matching and non-matching."""
     paths = ["stacks/dev/networking", "stacks/dev/app", "stacks/dev/dns"]
@@ -317,13 +783,224 @@ def test_core_stacks_ordered_by_pattern():
     assert result["prod-apps-stacks"] == ["stacks/prod/app-hello"]
 
 
+# =============================================================================
+# Dependency graph tests
+# =============================================================================
+
+
+def _write_stack(root: Path, stack: str, extra: str = "") -> None:
+    (root / stack).mkdir(parents=True, exist_ok=True)
+    (root / stack / "main.tf").write_text(
+        "terraform {\n"
+        '  backend "s3" {\n'
+        f'    key = "{stack}/terraform.tfstate"\n'
+        "  }\n"
+        "}\n" + extra
+    )
+
+
+def _remote_state(stack: str) -> str:
+    name = stack.rsplit("/", 1)[-1]
+    return (
+        f'data "terraform_remote_state" "{name}" {{\n'
+        '  backend = "s3"\n'
+        f'  config = {{ key = "{stack}/terraform.tfstate" }}\n'
+        "}\n"
+    )
+
+
+def test_parse_terraform_references(tmp_path):
+    """Backend key, remote state keys and local module sources are extracted."""
+    _write_stack(
+        tmp_path,
+        "stacks/dev/app",
+        _remote_state("stacks/dev/networking")
+        + '# data "terraform_remote_state" "old" { config = { key = "commented/out" } }\n'
+        + 'module "shared" {\n  source = "../../../modules/shared"\n}\n'
+        + 'module "remote" {\n  source = "git@github.com:org/repo.git"\n}\n',
+    )
+    refs = parse_terraform_references(tmp_path / "stacks/dev/app")
+    assert refs == {
+        "backend_key": "stacks/dev/app/terraform.tfstate",
+        "remote_state_keys": ["stacks/dev/networking/terraform.tfstate"],
+        "module_sources": ["../../../modules/shared"],
+    }
+
+
+def test_parse_terraform_references_comment_markers_in_strings(tmp_path):
+    """Comment markers inside strings don't hide later blocks, and quotes or braces in comments are ignored."""
+    _write_stack(
+        tmp_path,
+        "stacks/dev/app",
+        'locals {\n  arns = ["arn:aws:s3:::bucket/*"]\n  url = "https://example.com/#anchor"\n}\n'
+        + _remote_state("stacks/dev/networking")
+        + 'module "shared" {\n  # Don\'t use "{ here\n  source = "../../../modules/shared" /* } */\n}\n'
+        + '/*\nmodule "old" {\n  source = "../../../modules/old"\n}\n*/\n',
+    )
+    refs = parse_terraform_references(tmp_path / "stacks/dev/app")
+    assert refs == {
+        "backend_key": "stacks/dev/app/terraform.tfstate",
+        "remote_state_keys": ["stacks/dev/networking/terraform.tfstate"],
+        "module_sources": ["../../../modules/shared"],
+    }
+
+
+def test_build_dependency_graph(tmp_path):
+    """Edges come from remote state references to stacks in the given list."""
+    _write_stack(tmp_path, "stacks/dev/networking")
+    _write_stack(tmp_path, "stacks/dev/dns")
+    _write_stack(tmp_path, "stacks/dev/iam", _remote_state("stacks/dev/unselected"))
+    _write_stack(
+        tmp_path,
+        "stacks/dev/app",
+        _remote_state("stacks/dev/networking") + _remote_state("stacks/dev/dns"),
+    )
+    graph = build_dependency_graph(
+        tmp_path, ["stacks/dev/app", "stacks/dev/dns", "stacks/dev/iam", "stacks/dev/networking"]
+    )
+    assert graph == {
+        "stacks/dev/app": {"stacks/dev/networking", "stacks/dev/dns"},
+        "stacks/dev/dns": set(),
+        "stacks/dev/iam": set(),
+        "stacks/dev/networking": set(),
+    }
+
+
+def test_dependency_waves():
+    """Stacks are placed in the first wave after all of their dependencies."""
+    graph = {
+        "app": {"dns", "networking"},
+        "dns": {"networking"},
+        "iam": set(),
+        "networking": set(),
+        "monitoring": {"app"},
+    }
+    assert dependency_waves(graph) == [["iam", "networking"], ["dns"], ["app"], ["monitoring"]]
+
+
+def test_dependency_waves_cycle(capsys):
+    """Stacks in (or depending on) a cycle are placed in a final wave, with a warning."""
+    waves = dependency_waves({"a": {"b"}, "b": {"a"}, "c": set(), "d": {"a"}})
+
+    assert waves == [["c"], ["a", "b", "d"]]
+    assert "::warning::Dependency cycle between stacks" in capsys.readouterr().err
+
+
+def test_waves_output_cycle(tmp_path, monkeypatch):
+    """A remote state cycle between selected stacks doesn't fail the run."""
+    _write_stack(tmp_path, "stacks/dev/a", _remote_state("stacks/dev/b"))
+    _write_stack(tmp_path, "stacks/dev/b", _remote_state("stacks/dev/a"))
+    monkeypatch.setenv("DEPENDENCY_WAVES", "true")
+    result = run_main(selected_stacks="stacks/*/*", core_stacks="", root=tmp_path)
+
+    assert result["all-dev-stacks"] == ["stacks/dev/a", "stacks/dev/b"]
+    assert result["dev-waves"] == [["stacks/dev/a", "stacks/dev/b"]]
+
+
+def test_waves_not_requested(tmp_path, monkeypatch, capsys):
+    """Without DEPENDENCY_WAVES, no waves are output and no .tf files are parsed."""
+    _write_stack(tmp_path, "stacks/dev/a", _remote_state("stacks/dev/b"))
+    _write_stack(tmp_path, "stacks/dev/b")
+    monkeypatch.setenv("DETERMINE_STACKS_PROFILE", "true")
+    result = run_main(selected_stacks="stacks/*/*", core_stacks="", root=tmp_path)
+
+    assert "dev-waves" not in result
+    assert "prod-waves" not in result
+    profile = json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+    assert "dependency waves" not in {p["phase"] for p in profile["phases"]}
+
+
+def test_waves_output(tmp_path, monkeypatch):
+    """Waves are emitted per environment."""
+    _write_stack(tmp_path, "stacks/dev/networking")
+    _write_stack(tmp_path, "stacks/dev/app", _remote_state("stacks/dev/networking"))
+    _write_stack(tmp_path, "stacks/prod/app")
+    monkeypatch.setenv("DEPENDENCY_WAVES", "true")
+    monkeypatch.setenv("SELECTED_STACKS", "stacks/*/*")
+    result = main(None, tmp_path)
+
+    assert result["dev-waves"] == [["stacks/dev/networking"], ["stacks/dev/app"]]
+    assert result["prod-waves"] == [["stacks/prod/app"]]
+
+
+# =============================================================================
+# Module index tests
+# =============================================================================
+
+
+def _write_module(root: Path, module: str, source: str = "") -> None:
+    (root / module).mkdir(parents=True, exist_ok=True)
+    (root / module / "main.tf").write_text(
+        f'module "nested" {{\n  source = "{source}"\n}}\n' if source else 'variable "x" {}\n'
+    )
+
+
+def _module_repo(root: Path) -> None:
+    _write_module(root, "modules/base")
+    _write_module(root, "modules/shared", "../base")
+    (root / "modules/shared/templates").mkdir()
+    (root / "modules/shared/templates/policy.json").write_text("{}")
+    _write_stack(root, "stacks/dev/app", 'module "shared" {\n  source = "../../../modules/shared"\n}\n')
+    _write_stack(root, "stacks/prod/app", 'module "shared" {\n  source = "../../../modules/shared"\n}\n')
+    _write_stack(root, "stacks/dev/other", 'module "base" {\n  source = "../../../modules/base"\n}\n')
+    _write_stack(root, "stacks/dev/unrelated")
+
+
+def test_build_module_index_follows_nested_modules(tmp_path):
+    """Stacks are indexed under every module they use, including nested ones."""
+    _module_repo(tmp_path)
+    index = build_module_index(tmp_path, build_stack_index(tmp_path))
+    assert index == {
+        "modules/shared": {"stacks/dev/app", "stacks/prod/app"},
+        "modules/base": {"stacks/dev/app", "stacks/prod/app", "stacks/dev/other"},
+    }
+
+
+def test_changed_module_selects_affected_stacks(tmp_path, monkeypatch):
+    """Changed files under a module directory expand to the stacks using it."""
+    _module_repo(tmp_path)
+
+    monkeypatch.setenv("CHANGED_FILES", "modules/shared/templates/policy.json")
+    result = main(None, tmp_path)
+    assert result["all-stacks"] == ["stacks/dev/app", "stacks/prod/app"]
+
+    monkeypatch.setenv("CHANGED_FILES", "modules/base/main.tf,README.md")
+    result = main(None, tmp_path)
+    assert result["all-stacks"] == ["stacks/dev/app", "stacks/dev/other", "stacks/prod/app"]
+
+
+def test_changed_stack_files_skip_module_index(tmp_path, monkeypatch):
+    """Changes in a stack's subdirectories without .tf files don't build the module index."""
+    _module_repo(tmp_path)
+    (tmp_path / "stacks/dev/app/templates").mkdir()
+    (tmp_path / "stacks/dev/app/templates/policy.json").write_text("{}")
+    monkeypatch.setenv("CHANGED_FILES", "stacks/dev/app/templates/policy.json,stacks/prod/app/main.tf")
+    with mock.patch("determine_stacks.build_module_index") as build_module_index:
+        result = main(None, tmp_path)
+
+    build_module_index.assert_not_called()
+    assert result["all-stacks"] == ["stacks/prod/app"]
+
+
+def test_changed_module_inside_stack_selects_affected_stacks(tmp_path, monkeypatch):
+    """A module nested in a stack directory is still a module."""
+    _module_repo(tmp_path)
+    _write_module(tmp_path, "stacks/dev/app/modules/local")
+    _write_stack(tmp_path, "stacks/dev/other-app", 'module "local" {\n  source = "../app/modules/local"\n}\n')
+    monkeypatch.setenv("CHANGED_FILES", "stacks/dev/app/modules/local/main.tf")
+    result = main(None, tmp_path)
+
+    assert result["all-stacks"] == ["stacks/dev/other-app"]
+
+
 # =============================================================================
 # Integration tests
 # =============================================================================
 
 
-def test_mixed_stacks():
+def test_mixed_stacks(monkeypatch):
     """Mix of core and dependent stacks across environments."""
+    monkeypatch.setenv("DEPENDENCY_WAVES", "true")
     files = [
         "stacks/dev/app-too-tikki/main.tf",
         "stacks/dev/networking/main.tf",
@@ -341,6 +1018,15 @@ def test_mixed_stacks():
     ]
     assert result["prod-core-stacks"] == ["stacks/prod/dns"]
     assert result["prod-apps-stacks"] == ["stacks/prod/app-hello"]
+    # None of the test stacks depend on each other
+    assert result["dev-waves"] == [
+        [
+            "stacks/dev/app-custom",
+            "stacks/dev/app-too-tikki",
+            "stacks/dev/iam",
+            "stacks/dev/networking",
+        ]
+    ]
     assert result["all-dev-stacks"] == [
         "stacks/dev/app-custom",
         "stacks/dev/app-too-tikki",
@@ -358,6 +1044,116 @@ def test_mixed_stacks():
     ]
 
 
+def test_changed_files_file(tmp_path):
+    """Changed files can be streamed from a NUL-delimited file."""
+    changed = tmp_path / "changed.txt"
+    changed.write_bytes(b"stacks/dev/networking/main.tf\0stacks/prod/app-hello/main.tf\0")
+    result = run_main(changed_files="stacks/dev/iam/main.tf", changed_files_file=str(changed))
+
+    assert result["dev-core-stacks"] == ["stacks/dev/networking"]
+    assert result["prod-apps-stacks"] == ["stacks/prod/app-hello"]
+
+
+def test_changed_files_stdin(monkeypatch):
+    """Changed files are read from stdin when the file is '-'."""
+    stdin = io.TextIOWrapper(io.BytesIO(b"stacks/dev/iam/main.tf\nstacks/dev/iam/variables.tf\n"))
+    monkeypatch.setattr(sys, "stdin", stdin)
+    result = run_main(changed_files_file="-")
+
+    assert result["dev-core-stacks"] == ["stacks/dev/iam"]
+    assert result["all-stacks"] == ["stacks/dev/iam"]
+
+
+def test_profile(tmp_path, monkeypatch, capsys):
+    """Profiling reports phases to stderr and the step summary without changing outputs."""
+    summary = tmp_path / "summary.md"
+    files = ["stacks/dev/networking/main.tf", "stacks/prod/dns/main.tf"]
+    expected = run_main(changed_files=files)
+    capsys.readouterr()
+
+    monkeypatch.setenv("DETERMINE_STACKS_PROFILE", "true")
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", str(summary))
+    assert run_main(changed_files=files) == expected
+
+    profile = json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+    phases = {p["phase"]: p for p in profile["phases"]}
+    assert phases["collect candidates"]["items"] == 2
+    assert phases["detect stacks"]["files_read"] == 2
+    assert "| detect stacks |" in summary.read_text()
+
+
+# =============================================================================
+# Batch mode tests
+# =============================================================================
+
+
+def test_get_dirs_from_glob_groups():
+    """Each group gets the same result as a separate get_dirs_from_glob() call."""
+    groups = [["stacks/dev/*"], ["stacks/prod/app-*", "stacks/*/iam"], []]
+    result = get_dirs_from_glob_groups(Path("testdata"), groups)
+
+    assert result == [get_dirs_from_glob(Path("testdata"), g) for g in groups]
+
+
+def test_parse_batch_configs_errors():
+    """Invalid batch configurations are rejected up front."""
+    with pytest.raises(ValueError, match="JSON array"):
+        parse_batch_configs('{"name": "a"}')
+    with pytest.raises(ValueError, match="non-empty name"):
+        parse_batch_configs('[{"selected-stacks": "**"}]')
+    with pytest.raises(ValueError, match="Duplicate"):
+        parse_batch_configs('[{"name": "a"}, {"name": "a"}]')
+    with pytest.raises(ValueError, match="Unknown keys"):
+        parse_batch_configs('[{"name": "a", "selected": "**"}]')
+    with pytest.raises(ValueError, match="string or list"):
+        parse_batch_configs('[{"name": "a", "ignored-stacks": 1}]')
+
+
+def test_batch_matches_single_runs(monkeypatch):
+    """Every batch result equals the result of a separate run with the same inputs."""
+    files = ["stacks/dev/networking/main.tf", "stacks/dev/app-too-tikki/main.tf", "stacks/prod/iam/roles.tf"]
+    configs = [
+        {"name": "changed"},
+        {"name": "dev", "selected-stacks": "stacks/dev/*", "ignored-stacks": ["**/app-custom"]},
+        {"name": "prod", "selected-stacks": ["stacks/prod/*"], "core-stacks": "**/app-*"},
+    ]
+    expected = {
+        "changed": run_main(changed_files=files),
+        "dev": run_main(changed_files=files, selected_stacks="stacks/dev/*", ignored_stacks="**/app-custom"),
+        "prod": run_main(changed_files=files, selected_stacks="stacks/prod/*", core_stacks="**/app-*"),
+    }
+
+    monkeypatch.setenv("BATCH_CONFIGS", json.dumps(configs))
+    monkeypatch.setenv("CHANGED_FILES", _to_str(files))
+    monkeypatch.setenv("CORE_STACKS", _to_str(DEFAULT_CORE_STACKS))
+    writer = io.StringIO()
+    result = main(writer, Path("testdata"))
+
+    assert result == expected
+    key, value = writer.getvalue().strip().split("=", 1)
+    assert key == "batch-results"
+    assert json.loads(value) == expected
+
+
+def test_batch_main_without_configs():
+    """batch_main() (the determine-stacks-batch entry point) needs BATCH_CONFIGS."""
+    with pytest.raises(SystemExit, match="BATCH_CONFIGS must be set"):
+        batch_main(None, Path("testdata"))
+
+
+def test_batch_reads_files_once(monkeypatch, capsys):
+    """Stacks selected by several configurations are only detected once."""
+    monkeypatch.setenv("DETERMINE_STACKS_PROFILE", "true")
+    monkeypatch.setenv("DEPENDENCY_WAVES", "true")
+    monkeypatch.setenv("BATCH_CONFIGS", json.dumps([{"name": "a"}, {"name": "b", "ignored-stacks": "**/dns"}]))
+    run_main(changed_files=["stacks/dev/iam/main.tf", "stacks/prod/dns/main.tf"])
+
+    profile = json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+    phases = {p["phase"]: p for p in profile["phases"]}
+    assert phases["detect stacks"]["files_read"] == 2
+    assert phases["b: dependency waves"]["files_read"] == 0
+
+
 def test_glob_pattern():
     """Selection with glob pattern."""
     result = run_main(selected_stacks="stacks/*/app-*")
@@ -5,16 +5,27 @@ automerge rules and Terraform plan results.
 
 Usage:
   python3 evaluate_automerge.py --commit-message <str> --rules <json> --stack-changes <json>
+  python3 evaluate_automerge.py --commit-message <str> --rules <json> --plan-dir <dir>
+  python3 evaluate_automerge.py --rules <json> --batch < records.jsonl
 
-Output: prints "true" or "false" to stdout.
+Output: prints "true" or "false" to stdout. In batch mode, reads one JSON record
+{id, commit_message, stack_changes} per line from stdin and prints one JSON decision
+{id, automerge} per line, followed by throughput stats on stderr.
 """
 
 import argparse
+import glob
 import json
 import re
 import sys
-from pathlib import PurePosixPath
-from typing import NotRequired, TypedDict
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Iterable, NotRequired, TextIO, TypedDict
+
+# The streaming JSON reader is shared with the other actions, at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from json_stream import INCOMPLETE, JsonStreamReader  # noqa: E402
 
 
 class Upgrade(TypedDict):
@@ -47,34 +58,85 @@ def parse_upgrades(
     return json.loads(f"[{match.group(1)}]")
 
 
-def match_rule(package_file_dir: str, rules: list[Rule]) -> Rule | None:
+DEFAULT_POLICY = "no-changes"
+VALID_POLICIES = frozenset({"never", "no-changes", "any-changes"})
+
+
+class RuleSet:
+    """Automerge rules, compiled once for matching many upgrades.
+
+    All patterns are translated into a single regex alternation with the same semantics
+    as PurePosixPath.full_match, so the first matching rule is found in one pass. Matches
+    are memoized per packageFileDir. Unknown policies are reported once, when the rules
+    are loaded, and replaced by the default policy.
+    """
+
+    def __init__(
+        self,
+        rules: list[Rule],
+        default_policy: str = DEFAULT_POLICY,
+        valid_policies: frozenset[str] = VALID_POLICIES,
+    ):
+        self.rules: list[Rule] = []
+        for rule in rules:
+            rule = dict(rule)
+            for update_type, policy in rule.items():
+                if update_type != "pattern" and policy not in valid_policies:
+                    print(
+                        f"Warning: unknown policy '{policy}' for update type "
+                        f"'{update_type}' in rule '{rule['pattern']}', treating as '{default_policy}'",
+                        file=sys.stderr,
+                    )
+                    rule[update_type] = default_policy
+            self.rules.append(rule)
+
+        # Same translation as PurePosixPath.full_match, but for all patterns at once
+        alternatives = [
+            "(" + glob.translate(_pattern_str(rule["pattern"]), recursive=True, include_hidden=True, seps="/") + ")"
+            for rule in self.rules
+        ]
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+        self._matches: dict[str, Rule | None] = {}
+
+    def match(self, package_file_dir: str) -> Rule | None:
+        """Find the first rule whose pattern matches the packageFileDir."""
+        try:
+            return self._matches[package_file_dir]
+        except KeyError:
+            pass
+        rule = None
+        if self._regex is not None and (m := self._regex.match(_pattern_str(package_file_dir))):
+            rule = self.rules[m.lastindex - 1]
+        self._matches[package_file_dir] = rule
+        return rule
+
+
+def _pattern_str(path: str) -> str:
+    """A path (or pattern) as PurePosixPath.full_match sees it: normalized, and empty for "."."""
+    path_str = str(PurePosixPath(path))
+    return "" if path_str == "." else path_str
+
+
+def match_rule(package_file_dir: str, rules: list[Rule] | RuleSet) -> Rule | None:
     """Find the first rule whose pattern matches the packageFileDir."""
-    path = PurePosixPath(package_file_dir)
-    for rule in rules:
-        if path.full_match(rule["pattern"]):
-            return rule
-    return None
+    if not isinstance(rules, RuleSet):
+        rules = RuleSet(rules)
+    return rules.match(package_file_dir)
 
 
 def evaluate_upgrade(
     upgrade: Upgrade,
     rule: Rule,
     stack_changes: dict[str, bool],
-    default_policy: str = "no-changes",
-    valid_policies: frozenset[str] = frozenset({"never", "no-changes", "any-changes"}),
+    default_policy: str = DEFAULT_POLICY,
 ) -> bool:
-    """Evaluate a single upgrade against its matched rule and plan result."""
+    """Evaluate a single upgrade against its matched rule and plan result.
+
+    The rule's policies are expected to be valid, see RuleSet.
+    """
     update_type = upgrade["updateType"]
     policy = rule.get(update_type, default_policy)
 
-    if policy not in valid_policies:
-        print(
-            f"Warning: unknown policy '{policy}' for update type "
-            f"'{update_type}', treating as '{default_policy}'",
-            file=sys.stderr,
-        )
-        policy = default_policy
-
     if policy == "never":
         return False
 
@@ -89,11 +151,14 @@ def evaluate_upgrade(
 
 def evaluate(
     commit_message: str,
-    rules: list[Rule],
+    rules: list[Rule] | RuleSet,
     stack_changes: dict[str, bool],
     allowed_package: str = "oslokommune/golden-path-boilerplate",
 ) -> bool:
     """Returns True if all upgrades in the commit are eligible for automerge."""
+    if not isinstance(rules, RuleSet):
+        rules = RuleSet(rules)
+
     upgrades = parse_upgrades(commit_message)
     if upgrades is None:
         return False
@@ -105,7 +170,7 @@ def evaluate(
         if upgrade.get("packageName") != allowed_package:
             return False
 
-        rule = match_rule(upgrade["packageFileDir"], rules)
+        rule = rules.match(upgrade["packageFileDir"])
         if rule is None:
             return False
 
@@ -115,22 +180,147 @@ def evaluate(
     return True
 
 
+class Decision(TypedDict):
+    id: object
+    automerge: bool
+    error: NotRequired[str]
+
+
+def evaluate_batch(lines: Iterable[str], rules: list[Rule] | RuleSet, output: TextIO) -> int:
+    """Evaluate JSONL records {id, commit_message, stack_changes} against the same rules.
+
+    Writes one JSON decision per record as soon as it's made. Records that can't be
+    evaluated are rejected with an error instead of stopping the batch. Returns the
+    number of records evaluated.
+    """
+    if not isinstance(rules, RuleSet):
+        rules = RuleSet(rules)
+
+    count = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        count += 1
+        record_id = None
+        decision: Decision
+        try:
+            record = json.loads(line)
+            record_id = record.get("id")
+            automerge = evaluate(record["commit_message"], rules, record.get("stack_changes", {}))
+            decision = {"id": record_id, "automerge": automerge}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            decision = {"id": record_id, "automerge": False, "error": f"{type(e).__name__}: {e}"}
+        output.write(json.dumps(decision) + "\n")
+        output.flush()
+    return count
+
+
+def _is_no_op(resource_change: object) -> bool:
+    change = resource_change.get("change") if isinstance(resource_change, dict) else None
+    return isinstance(change, dict) and change.get("actions") == ["no-op"]
+
+
+def plan_has_changes(stream: TextIO, chunk_size: int = 1024 * 1024) -> bool:
+    """Check whether a `terraform show -json` plan has any resource changes.
+
+    Stops reading at the first resource change whose actions aren't ["no-op"]. A resource
+    change without actions counts as a change.
+    """
+    reader = JsonStreamReader(stream, chunk_size)
+    for key in reader.iter_object():
+        if key != "resource_changes":
+            reader.skip_value()
+            continue
+        for _ in reader.iter_array():
+            resource_change = reader.read_buffered()
+            if resource_change is not INCOMPLETE:
+                if not _is_no_op(resource_change):
+                    return True
+                continue
+            if reader.peek() != "{":
+                return True
+            no_op = False
+            for resource_key in reader.iter_object():
+                if resource_key != "change" or reader.peek() != "{":
+                    reader.skip_value()
+                    continue
+                for change_key in reader.iter_object():
+                    if change_key != "actions":
+                        reader.skip_value()
+                        continue
+                    if reader.read_value() != ["no-op"]:
+                        return True
+                    no_op = True
+            if not no_op:
+                return True
+        return False
+    return False
+
+
+def plan_file_has_changes(path: Path) -> bool:
+    with open(path, encoding="utf-8") as f:
+        return plan_has_changes(f)
+
+
+def stack_changes_from_plans(plan_dir: Path, max_workers: int | None = None) -> dict[str, bool]:
+    """Map stack paths to whether their plan has changes, from a directory of plan JSON files.
+
+    The plan for a stack is expected at `<plan_dir>/<stack path>.json`. Plans are checked
+    in parallel in a process pool.
+    """
+    files = sorted(plan_dir.rglob("*.json"))
+    stacks = [path.relative_to(plan_dir).with_suffix("").as_posix() for path in files]
+    if len(files) <= 1:
+        return dict(zip(stacks, map(plan_file_has_changes, files)))
+    with ProcessPoolExecutor(max_workers) as executor:
+        return dict(zip(stacks, executor.map(plan_file_has_changes, files)))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Evaluate whether golden-path-boilerplate upgrades are safe to automerge"
     )
-    parser.add_argument("--commit-message", required=True, help="Full commit message")
+    parser.add_argument("--commit-message", help="Full commit message")
     parser.add_argument("--rules", required=True, help="JSON array of automerge rules")
     parser.add_argument(
         "--stack-changes",
-        required=True,
         help="JSON object mapping stack paths to booleans",
     )
+    parser.add_argument(
+        "--plan-dir",
+        type=Path,
+        help="Directory with a `terraform show -json` plan per stack, at <plan-dir>/<stack path>.json",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Read JSONL records {id, commit_message, stack_changes} from stdin",
+    )
     args = parser.parse_args()
 
+    if args.batch:
+        rules = RuleSet(json.loads(args.rules))
+        start = time.perf_counter()
+        count = evaluate_batch(sys.stdin, rules, sys.stdout)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Evaluated {count} records in {elapsed:.3f}s "
+            f"({count / elapsed if elapsed else 0:.0f} records/s)",
+            file=sys.stderr,
+        )
+        sys.exit(0)
+
+    if args.commit_message is None or (args.stack_changes is None) == (args.plan_dir is None):
+        parser.error("--commit-message and one of --stack-changes or --plan-dir are required unless --batch is used")
+
+    if args.plan_dir is not None:
+        stack_changes = stack_changes_from_plans(args.plan_dir)
+    else:
+        stack_changes = json.loads(args.stack_changes)
+
     result = evaluate(
         args.commit_message,
         json.loads(args.rules),
-        json.loads(args.stack_changes),
+        stack_changes,
     )
     print("true" if result else "false")
@@ -1,5 +1,9 @@
+import contextlib
+import io
 import json
+import tempfile
 import unittest
+from pathlib import Path
 
 import evaluate_automerge as ea
 
@@ -129,5 +133,138 @@ class TestMultipleUpgrades(unittest.TestCase):
         self.assertFalse(ea.evaluate(commit_message, DEFAULT_RULES, stack_changes))
 
 
+class TestRuleSet(unittest.TestCase):
+    def test_first_match_wins(self):
+        rule_set = ea.RuleSet(DEFAULT_RULES)
+        self.assertEqual(rule_set.match("stacks/prod/app"), DEFAULT_RULES[0])
+        self.assertEqual(rule_set.match("stacks/dev/app"), DEFAULT_RULES[1])
+        self.assertIsNone(ea.RuleSet([{"pattern": "stacks/*"}]).match("stacks/dev/app"))
+
+    def test_matches_are_memoized(self):
+        rule_set = ea.RuleSet(DEFAULT_RULES)
+        upgrades = [_upgrade(dep_name=f"app-{i}", update_type="patch") for i in range(1000)]
+        self.assertTrue(ea.evaluate(_make_commit_message(upgrades), rule_set, {}))
+        self.assertEqual(list(rule_set._matches), ["stacks/dev/app"])
+
+    def test_unknown_policy_warns_once(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            rule_set = ea.RuleSet([{"pattern": "**", "minor": "sometimes"}])
+            upgrades = [_upgrade(dep_name=f"app-{i}") for i in range(10)]
+            self.assertTrue(ea.evaluate(_make_commit_message(upgrades), rule_set, {}))
+
+        self.assertEqual(stderr.getvalue().count("unknown policy 'sometimes'"), 1)
+        self.assertEqual(rule_set.rules[0]["minor"], "no-changes")
+
+
+class TestBatch(unittest.TestCase):
+    def test_one_decision_per_record(self):
+        records = [
+            {"id": 1, "commit_message": _make_commit_message([_upgrade()]), "stack_changes": {}},
+            {"id": 2, "commit_message": "no marker", "stack_changes": {}},
+            {
+                "id": 3,
+                "commit_message": _make_commit_message(
+                    [_upgrade(package_file_dir="stacks/prod/app", update_type="minor")]
+                ),
+                "stack_changes": {"stacks/prod/app": True},
+            },
+        ]
+        lines = [json.dumps(r) + "\n" for r in records] + ["\n"]
+        output = io.StringIO()
+
+        self.assertEqual(ea.evaluate_batch(lines, DEFAULT_RULES, output), 3)
+        decisions = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(
+            decisions,
+            [
+                {"id": 1, "automerge": True},
+                {"id": 2, "automerge": False},
+                {"id": 3, "automerge": False},
+            ],
+        )
+
+    def test_invalid_record_is_rejected(self):
+        lines = ['{"id": "a"}\n', "not json\n"]
+        output = io.StringIO()
+
+        self.assertEqual(ea.evaluate_batch(lines, DEFAULT_RULES, output), 2)
+        decisions = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([d["id"] for d in decisions], ["a", None])
+        self.assertTrue(all(not d["automerge"] and "error" in d for d in decisions))
+
+
+def _plan(*actions: list[str]) -> dict:
+    """Build a minimal `terraform show -json` plan with the given resource change actions."""
+    return {
+        "format_version": "1.2",
+        "planned_values": {"root_module": {"resources": [{"values": {"actions": ["create"]}}]}},
+        "resource_changes": [
+            {
+                "address": f"null_resource.r{i}",
+                "change": {"actions": a, "before": {"tags": {"a": "}]\\\""}}, "after": None},
+            }
+            for i, a in enumerate(actions)
+        ],
+        "prior_state": {"values": {}},
+    }
+
+
+class TestPlanChanges(unittest.TestCase):
+    def test_plan_has_changes(self):
+        cases = [
+            (_plan(), False),
+            (_plan(["no-op"], ["no-op"]), False),
+            (_plan(["no-op"], ["delete", "create"]), True),
+            (_plan(["update"]), True),
+            ({"format_version": "1.2"}, False),
+        ]
+        for plan, expected in cases:
+            for chunk_size in (1, 7, 1024 * 1024):
+                with self.subTest(plan=plan, chunk_size=chunk_size):
+                    reader = io.StringIO(json.dumps(plan, indent=2))
+                    self.assertEqual(ea.plan_has_changes(reader, chunk_size), expected)
+
+    def test_malformed_resource_changes_count_as_changes(self):
+        cases = [
+            ({"address": "a"}, True),
+            ({"address": "a", "change": None}, True),
+            ({"address": "a", "change": {}}, True),
+            ({"address": "a", "change": {"actions": None}}, True),
+            (None, True),
+            (["no-op"], True),
+            ({"address": "a", "change": {"actions": ["no-op"]}, "other": None}, False),
+        ]
+        for resource_change, expected in cases:
+            plan = {"resource_changes": [resource_change, {"change": {"actions": ["no-op"]}}]}
+            # With 1 character chunks, resource changes are walked instead of decoded from the buffer
+            for chunk_size in (1, 1024 * 1024):
+                with self.subTest(resource_change=resource_change, chunk_size=chunk_size):
+                    reader = io.StringIO(json.dumps(plan))
+                    self.assertEqual(ea.plan_has_changes(reader, chunk_size), expected)
+
+    def test_stops_at_first_change(self):
+        text = json.dumps(_plan(["create"]))
+        # Everything after the first resource change is never read, so it may be invalid
+        truncated = text[: text.index('"prior_state"')] + "not json"
+        self.assertTrue(ea.plan_has_changes(io.StringIO(truncated)))
+
+    def test_invalid_plan_raises(self):
+        with self.assertRaises(ValueError):
+            ea.plan_has_changes(io.StringIO('{"resource_changes": [{"change": '))
+
+    def test_stack_changes_from_plans(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            plan_dir = Path(tmp)
+            (plan_dir / "stacks/dev").mkdir(parents=True)
+            (plan_dir / "stacks/dev/app.json").write_text(json.dumps(_plan(["no-op"])))
+            (plan_dir / "stacks/dev/db.json").write_text(json.dumps(_plan(["update"])))
+
+            self.assertEqual(
+                ea.stack_changes_from_plans(plan_dir, max_workers=2),
+                {"stacks/dev/app": False, "stacks/dev/db": True},
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Small GitHub REST API client shared by the actions, using only the standard library.
+
+Compared to running `gh api` once per call, it:
+- keeps connections open and reuses them (one pool per client),
+- caches GET responses on disk and revalidates them with ETags, so unchanged data is
+  served from a 304 (which doesn't count against the rate limit), or without a request
+  at all when it's younger than `max_age`,
+- makes identical GETs only once per client, even when they're made concurrently,
+- retries server errors with exponential backoff, and waits for rate limits to reset,
+- follows `Link: rel="next"` headers to fetch every page of a list, with --paginate.
+
+The token is read from GH_TOKEN or GITHUB_TOKEN and the API URL from GITHUB_API_URL.
+The cache is kept in $RUNNER_TEMP/github-api-cache by default, so within one job,
+repeated calls for the same data can share it.
+
+Usage:
+  github_api.py repos/OWNER/REPO/commits/SHA --select commit.message
+  github_api.py repos/OWNER/REPO/actions/runs/1/jobs repos/OWNER/REPO/actions/runs/2/jobs
+  github_api.py --paginate "repos/OWNER/REPO/actions/runs/1/jobs?per_page=100"
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+from urllib.parse import urlsplit
+
+API_URL = "https://api.github.com"
+API_VERSION = "2022-11-28"
+
+
+class GitHubAPIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"GitHub API error {status}: {message}")
+        self.status = status
+
+
+class StaleConnection(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to a single host, shared between threads."""
+
+    def __init__(self, base_url: str, size: int = 4, timeout: float = 30):
+        url = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.host = url.netloc
+        self.size = size
+        self.timeout = timeout
+        self.idle: list[http.client.HTTPConnection] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[tuple[http.client.HTTPConnection, bool]]:
+        """Yield a connection, and whether it has been used before. It's closed on errors."""
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self.connection_class(self.host, timeout=self.timeout)
+        try:
+            yield conn, reused
+        except BaseException:
+            conn.close()
+            raise
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class GitHubClient:
+    """GitHub REST API client. See the module docstring.
+
+    Paths are relative to the API URL (e.g. `repos/OWNER/REPO`) and may include a query
+    string. Requests that fail with a server or connection error are retried up to
+    max_retries times. Rate limits are waited out if they reset within max_wait seconds.
+    """
+
+    def __init__(
+        self,
+        token: str | None = None,
+        base_url: str | None = None,
+        cache_dir: Path | None = None,
+        max_retries: int = 4,
+        max_wait: float = 60,
+        pool_size: int = 4,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.token = token if token is not None else os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN", "")
+        self.base_url = (base_url or os.environ.get("GITHUB_API_URL") or API_URL).rstrip("/")
+        self.cache_dir = cache_dir
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.pool_size = pool_size
+        self.sleep = sleep
+        self.pool = ConnectionPool(self.base_url, pool_size)
+        self.prefix = urlsplit(self.base_url).path
+        self.gets: dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def __enter__(self) -> "GitHubClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def send(self, method: str, path: str, body: bytes | None, headers: dict[str, str]) -> tuple[int, dict, bytes]:
+        """Send one request over a pooled connection, without retries."""
+        headers = {
+            "Accept": "application/vnd.github+json",
+            "User-Agent": "oslokommune-composite-actions",
+            "X-GitHub-Api-Version": API_VERSION,
+            **({"Authorization": f"Bearer {self.token}"} if self.token else {}),
+            **headers,
+        }
+        url = f"{self.prefix}/{path.lstrip('/')}"
+        while True:
+            try:
+                with self.pool.connection() as (conn, reused):
+                    try:
+                        conn.request(method, url, body=body, headers=headers)
+                        response = conn.getresponse()
+                    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                        if reused:
+                            raise StaleConnection
+                        raise
+                    data = response.read()
+                    if response.will_close:
+                        conn.close()
+                    return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+            except StaleConnection:
+                # The server closed an idle keep-alive connection; try again on a new one
+                continue
+
+    def retry_delay(self, attempt: int, status: int | None, headers: dict) -> float | None:
+        """Seconds to wait before retrying, or None if the response shouldn't be retried."""
+        if status in (403, 429) and ("retry-after" in headers or headers.get("x-ratelimit-remaining") == "0"):
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+            return max(float(headers.get("x-ratelimit-reset", 0)) - time.time(), 0) + 1
+        if status is None or status >= 500:
+            return min(2**attempt, self.max_wait) * random.uniform(0.5, 1)
+        return None
+
+    def request(self, method: str, path: str, body: Any = None, headers: dict[str, str] | None = None) -> tuple[int, dict, bytes]:
+        """Send a request, retrying server errors and rate limits. Raises GitHubAPIError on errors."""
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {**({"Content-Type": "application/json"} if data else {}), **(headers or {})}
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, response_headers, response = self.send(method, path, data, headers)
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Warning: {method} {path} failed ({e}), retrying", file=sys.stderr)
+                self.sleep(self.retry_delay(attempt, None, {}))
+                continue
+            if status < 400:
+                return status, response_headers, response
+            delay = self.retry_delay(attempt, status, response_headers)
+            if delay is None or delay > self.max_wait or attempt == self.max_retries:
+                raise GitHubAPIError(status, error_message(response))
+            print(f"Warning: {method} {path} returned {status}, retrying in {delay:.0f}s", file=sys.stderr)
+            self.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def cache_path(self, path: str) -> Path | None:
+        if self.cache_dir is None:
+            return None
+        # The token is part of the key, so responses aren't shared between different credentials
+        key = hashlib.sha256(f"{self.token}\0{self.base_url}/{path.lstrip('/')}".encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def next_page(self, headers: dict) -> str | None:
+        """The path of the next page from a `Link` header, relative to the API URL."""
+        if match := re.search(r'<([^>]+)>;\s*rel="next"', headers.get("link", "")):
+            url = urlsplit(match.group(1))
+            return url.path.removeprefix(self.prefix) + (f"?{url.query}" if url.query else "")
+        return None
+
+    def fetch(self, path: str, max_age: float | None) -> tuple[Any, str | None]:
+        """GET a path through the cache, and return the decoded JSON and the next page's path."""
+        cache_path = self.cache_path(path)
+        cached = None
+        if cache_path is not None:
+            try:
+                cached = json.loads(cache_path.read_text())
+            except (OSError, ValueError):
+                pass
+        if cached is not None and max_age is not None and time.time() - cached["fetched"] < max_age:
+            return json.loads(cached["body"]), cached.get("next")
+
+        headers = {}
+        if cached is not None and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        status, response_headers, body = self.request("GET", path, headers=headers)
+        if status == 304 and cached is not None:
+            cached["fetched"] = time.time()
+        else:
+            cached = {
+                "etag": response_headers.get("etag"),
+                "next": self.next_page(response_headers),
+                "fetched": time.time(),
+                "body": body.decode(),
+            }
+        if cache_path is not None:
+            write_atomic(cache_path, json.dumps(cached))
+        return json.loads(cached["body"]), cached.get("next")
+
+    def get(self, path: str, max_age: float | None = None) -> Any:
+        """GET a path and return the decoded JSON.
+
+        Identical GETs made through this client are only sent once. With max_age, a cached
+        response younger than that many seconds is used without making a request.
+        """
+        return self.get_page(path, max_age)[0]
+
+    def get_page(self, path: str, max_age: float | None = None) -> tuple[Any, str | None]:
+        """Like get(), but also return the path of the next page, if there is one."""
+        with self.lock:
+            future = self.gets.get(path)
+            owner = future is None
+            if owner:
+                future = self.gets[path] = Future()
+        if owner:
+            try:
+                future.set_result(self.fetch(path, max_age))
+            except BaseException as e:
+                future.set_exception(e)
+                with self.lock:
+                    # Let failed requests be tried again
+                    del self.gets[path]
+        return future.result()
+
+    def get_all(self, path: str, max_age: float | None = None) -> Any:
+        """GET every page of a paginated path and merge them.
+
+        List responses are concatenated. For object responses that wrap a list (like
+        `{"total_count": 120, "jobs": [...]}`), the lists in them are concatenated.
+        """
+        first, next_path = self.get_page(path, max_age)
+        # Copy, so merging doesn't change the (shared) first page
+        result = list(first) if isinstance(first, list) else dict(first)
+        while next_path:
+            page, next_path = self.get_page(next_path, max_age)
+            if isinstance(result, list):
+                result.extend(page)
+            else:
+                for key, value in page.items():
+                    if isinstance(value, list) and isinstance(result.get(key), list):
+                        result[key] = result[key] + value
+        return result
+
+    def get_many(self, paths: list[str], max_age: float | None = None, paginate: bool = False) -> list[Any]:
+        """GET several paths concurrently, over up to pool_size connections."""
+        get = self.get_all if paginate else self.get
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            return list(executor.map(lambda path: get(path, max_age), paths))
+
+
+def error_message(body: bytes) -> str:
+    try:
+        return json.loads(body)["message"]
+    except (ValueError, KeyError, TypeError):
+        return body.decode(errors="replace")[:200]
+
+
+def write_atomic(path: Path, content: str) -> None:
+    """Write a file through a temporary file and a rename, so readers never see partial content."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def select(value: Any, expression: str) -> Any:
+    """Follow a path like `commit.author.name` or `jobs[0].name` into a value (missing → None)."""
+    for key, index in re.findall(r"([^.\[\]]+)|\[(\d+)\]", expression):
+        if index:
+            value = value[int(index)] if isinstance(value, list) and int(index) < len(value) else None
+        else:
+            value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def default_cache_dir() -> Path:
+    if runner_temp := os.environ.get("RUNNER_TEMP"):
+        return Path(runner_temp) / "github-api-cache"
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "github-api"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GET one or more GitHub API paths")
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="API path, e.g. repos/OWNER/REPO/commits/SHA")
+    parser.add_argument("--select", help="Only output this part of the response, e.g. `commit.message`")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="Use a cached response younger than this many seconds without revalidating it",
+    )
+    parser.add_argument("--cache-dir", type=Path, default=default_cache_dir(), help="Directory for cached responses")
+    parser.add_argument(
+        "--paginate",
+        action="store_true",
+        help="Follow `Link: rel=\"next\"` headers and merge all pages into one response",
+    )
+    args = parser.parse_args()
+
+    try:
+        with GitHubClient(cache_dir=args.cache_dir) as client:
+            results = client.get_many(args.paths, args.max_age, args.paginate)
+    except (GitHubAPIError, OSError, http.client.HTTPException) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.select:
+        results = [select(result, args.select) for result in results]
+    if len(results) == 1:
+        # Like `gh api --jq`: strings are written as is
+        print(results[0] if isinstance(results[0], str) else json.dumps(results[0]))
+    else:
+        # One compact JSON document per line, in the order of the paths
+        for result in results:
+            print(json.dumps(result))
@@ -0,0 +1,159 @@
+"""Pull-style reader for large JSON documents, shared by the actions, using only the standard library.
+
+JsonStreamReader reads a text stream one chunk at a time. Only the values the caller
+walks into are inspected: values that fit in the current chunk are decoded with the C
+decoder (json.JSONDecoder.raw_decode), and larger objects and arrays are walked one
+member at a time. Memory use is therefore bounded by the chunk size and the largest
+single leaf value, not the document size.
+
+Nothing is read past the end of the values that are walked, so text after the document
+(like diagnostics on the same stream) is never read.
+"""
+
+import json
+import re
+from typing import Callable, Iterator, TextIO
+
+# Returned by JsonStreamReader.read_buffered for containers that don't fit in the current chunk
+INCOMPLETE = object()
+
+
+class JsonStreamReader:
+    """Reads a JSON document from a text stream, one chunk at a time. See the module docstring."""
+
+    DECODER = json.JSONDecoder()
+    WHITESPACE = re.compile(r"\s*")
+    NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+    def __init__(self, stream: TextIO, chunk_size: int = 64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Read the next chunk into the buffer. Returns False at the end of the stream."""
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def seek(self, char: str) -> bool:
+        """Skip ahead to the next occurrence of char. Returns False if there is none."""
+        while (index := self.buffer.find(char, self.pos)) == -1:
+            self.pos = len(self.buffer)
+            if not self.fill():
+                return False
+        self.pos = index
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character without consuming it."""
+        if self.pos < len(self.buffer) and not self.buffer[self.pos].isspace():
+            return self.buffer[self.pos]
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON document, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def read_value(self) -> object:
+        """Decode the value at the current position, reading more chunks as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.fill():
+                    continue
+                raise ValueError(f"Invalid JSON document: {e}") from None
+            # A number at the end of the buffer may continue in the next chunk
+            if isinstance(value, (int, float)) and self.NUMBER_TAIL.fullmatch(self.buffer, end) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def read_buffered(self) -> object:
+        """Decode the value at the current position if it's complete in the buffer.
+
+        For an object or array that continues in the next chunk, returns INCOMPLETE (and
+        consumes nothing), in which case the caller should walk it with iter_object or
+        iter_array instead. Other values are always decoded.
+        """
+        if self.peek() not in "{[":
+            return self.read_value()
+        try:
+            value, self.pos = self.DECODER.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            return INCOMPLETE
+        return value
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of an object. The caller must read or skip each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError("Expected an object key in JSON document")
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def iter_array(self) -> Iterator[None]:
+        """Yield once per array element. The caller must read or skip each element."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def skip_value(self) -> None:
+        """Skip the value at the current position.
+
+        A container that doesn't fit in the buffer is walked, and its members are skipped
+        one at a time.
+        """
+        first = self.peek()
+        if self.read_buffered() is not INCOMPLETE:
+            return
+        for _ in self.iter_object() if first == "{" else self.iter_array():
+            self.skip_value()
+
+    def copy_value(self, write: Callable[[str], object]) -> None:
+        """Write the value at the current position, formatted like json.dumps would."""
+        value = self.read_buffered()
+        if value is not INCOMPLETE:
+            write(json.dumps(value))
+        elif self.peek() == "{":
+            separator = "{"
+            for key in self.iter_object():
+                write(separator + json.dumps(key) + ": ")
+                separator = ", "
+                self.copy_value(write)
+            write("}" if separator == ", " else "{}")
+        else:
+            separator = "["
+            for _ in self.iter_array():
+                write(separator)
+                separator = ", "
+                self.copy_value(write)
+            write("]" if separator == ", " else "[]")
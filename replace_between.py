@@ -8,11 +8,163 @@
 # ]
 # ///
 
+import os
 import sys
 import re
+import tempfile
 import click
 
 
+def add_section(target_content, source_content, start, end, discard_markers=False, create_position="append"):
+    """Add a new section with markers to target_content, at create_position."""
+    # Create new content with markers
+    if discard_markers:
+        new_content = source_content
+    else:
+        new_content = f"{start}\n{source_content}\n{end}"
+
+    # Add to existing content based on create_position
+    if create_position == "append":
+        if target_content and not target_content.endswith("\n"):
+            # Add a newline if the file doesn't end with one
+            return target_content + "\n\n" + new_content
+        return target_content + "\n" + new_content
+    # prepend
+    if target_content and not target_content.startswith("\n"):
+        # Add a newline if needed
+        return new_content + "\n\n" + target_content
+    return new_content + "\n" + target_content
+
+
+def replace_section(
+    target_content, source_content, start, end,
+    discard_markers=False, regex=False, create=False, create_position="append"
+):
+    """
+    Replace the content between start and end in target_content with source_content.
+
+    Returns the new content and the number of replacements. If the markers aren't found,
+    they're added if create is set (at create_position), otherwise the content is
+    returned unchanged.
+    """
+    # Handle marker escaping for regex
+    if not regex:
+        escaped_start = re.escape(start)
+        escaped_end = re.escape(end)
+    else:
+        escaped_start = start
+        escaped_end = end
+
+    # Create pattern for finding content between markers
+    if discard_markers:
+        pattern = f"{escaped_start}.*?{escaped_end}"
+        repl = source_content
+    else:
+        pattern = f"({escaped_start}).*?({escaped_end})"
+        repl = f"\\1\n{source_content}\n\\2"
+
+    # Perform replacement
+    result, count = re.subn(pattern, repl, target_content, flags=re.DOTALL)
+
+    if count == 0 and create:
+        result = add_section(target_content, source_content, start, end, discard_markers, create_position)
+
+    return result, count
+
+
+def section_markers(section):
+    return f"<!-- {section} BEGIN -->", f"<!-- {section} END -->"
+
+
+def replace_sections(target_content, sources, discard_markers=False, create=False, create_position="append"):
+    """
+    Replace several sections at once, in a single scan over target_content.
+
+    sources maps section names to their new content. Each begin marker is matched with the
+    first end marker of the same section after it, like replace_section does. Returns the
+    new content and the number of replacements per section. Sections that aren't found
+    are added in the order given if create is set.
+    """
+    markers = {section_markers(section)[0]: section for section in sources}
+    begin = re.compile("|".join(map(re.escape, markers)))
+
+    counts = dict.fromkeys(sources, 0)
+    pieces = []
+    copied = 0
+    pos = 0
+    while (match := begin.search(target_content, pos)) is not None:
+        section = markers[match.group()]
+        start, end = section_markers(section)
+        end_index = target_content.find(end, match.end())
+        if end_index == -1:
+            pos = match.start() + 1
+            continue
+        pieces.append(target_content[copied:match.start()])
+        if discard_markers:
+            pieces.append(sources[section])
+        else:
+            pieces.append(f"{start}\n{sources[section]}\n{end}")
+        copied = pos = end_index + len(end)
+        counts[section] += 1
+    pieces.append(target_content[copied:])
+    result = "".join(pieces)
+
+    if create:
+        for section, count in counts.items():
+            if count == 0:
+                result = add_section(result, sources[section], *section_markers(section), discard_markers, create_position)
+    return result, counts
+
+
+def write_if_changed(path, content):
+    """
+    Atomically replace the file at path with content, unless it already has that content.
+
+    Returns True if the file was written.
+    """
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~current_umask())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def parse_section_sources(mappings):
+    """Parse SECTION=FILE mappings and read the files ("-" is stdin)."""
+    sources = {}
+    for mapping in mappings:
+        section, separator, path = mapping.partition("=")
+        if not separator or not section or not path:
+            raise click.BadParameter(f"expected SECTION=FILE, got {mapping!r}", param_hint="--map")
+        if section in sources:
+            raise click.BadParameter(f"section {section!r} is given more than once", param_hint="--map")
+        with click.open_file(path) as f:
+            sources[section] = f.read()
+    return sources
+
+
 @click.command()
 @click.option("--section", "-s", default="CONTENT", help="Section name to look for in markers (default: 'CONTENT')")
 @click.option("--start", help="Custom start marker text (overrides --section if provided)")
@@ -27,9 +179,12 @@ import click
 @click.option("--create", "-c", is_flag=True, help="Create markers if they don't exist (appends to the file)")
 @click.option("--create-position", type=click.Choice(["append", "prepend"]), default="append",
               help="Where to add new markers if --create is used (default: append)")
+@click.option("--map", "-m", "mappings", multiple=True, metavar="SECTION=FILE",
+              help="Replace SECTION with the content of FILE ('-' for stdin). Can be repeated to replace "
+                   "several sections in one pass (overrides --section and --source)")
 def replace_between(
     section, start, end, source, target, output, in_place, dry_run,
-    discard_markers, regex, create, create_position
+    discard_markers, regex, create, create_position, mappings
 ):
     """
     Replace text between specified markers with content from a file or stdin.
@@ -55,11 +210,23 @@ def replace_between(
 
     # Create markers if they don't exist:
     replace_between --section API --source api_docs.md --target README.md --create
+
+    # Replace several sections in one pass:
+    replace_between --map API=api_docs.md --map USAGE=usage.md --target README.md --in-place
     """
     # Ensure we have required parameters
     if not target:
         raise click.UsageError("--target is required")
 
+    if mappings:
+        if start or end or regex:
+            raise click.UsageError("--map can't be used with --start, --end or --regex")
+        replace_many(
+            parse_section_sources(mappings), target, output, in_place, dry_run,
+            discard_markers, create, create_position
+        )
+        return
+
     # Determine start and end markers
     if start and end:
         # Use explicit markers if provided
@@ -82,48 +249,16 @@ def replace_between(
     # Fetch source content for replacement
     source_content = source.read()
 
-    # Handle marker escaping for regex
-    if not regex:
-        escaped_start = re.escape(start)
-        escaped_end = re.escape(end)
-    else:
-        escaped_start = start
-        escaped_end = end
-
-    # Create pattern for finding content between markers
-    if discard_markers:
-        pattern = f"{escaped_start}.*?{escaped_end}"
-        repl = source_content
-    else:
-        pattern = f"({escaped_start}).*?({escaped_end})"
-        repl = f"\\1\n{source_content}\n\\2"
-
-    # Perform replacement
-    result, count = re.subn(pattern, repl, target_content, flags=re.DOTALL)
+    result, count = replace_section(
+        target_content, source_content, start, end, discard_markers, regex, create, create_position
+    )
 
     # Handle case when markers don't exist and --create is specified
     if count == 0:
         if create:
-            # Create new content with markers
-            if discard_markers:
-                new_content = source_content
-            else:
-                new_content = f"{start}\n{source_content}\n{end}"
-
-            # Add to existing content based on create_position
             if create_position == "append":
-                if target_content and not target_content.endswith("\n"):
-                    # Add a newline if the file doesn't end with one
-                    result = target_content + "\n\n" + new_content
-                else:
-                    result = target_content + "\n" + new_content
                 click.echo(f"Markers not found. Appending to target file.", err=True)
-            else:  # prepend
-                if target_content and not target_content.startswith("\n"):
-                    # Add a newline if needed
-                    result = new_content + "\n\n" + target_content
-                else:
-                    result = new_content + "\n" + target_content
+            else:
                 click.echo(f"Markers not found. Prepending to target file.", err=True)
         else:
             # No replacements made and --create not specified - error
@@ -150,9 +285,9 @@ def replace_between(
 
     # Handle in-place editing
     if in_place:
-        with open(output_name, 'w') as f:
-            f.write(result)
-        if count == 0 and create:
+        if not write_if_changed(output_name, result):
+            click.echo(f"No changes in {output_name}", err=True)
+        elif count == 0 and create:
             click.echo(f"Created new markers in {output_name}", err=True)
         else:
             click.echo(f"Replaced {count} occurrences in {output_name}", err=True)
@@ -166,5 +301,38 @@ def replace_between(
                 click.echo(f"Replaced {count} occurrences in {output.name}", err=True)
 
 
+def replace_many(sources, target, output, in_place, dry_run, discard_markers, create, create_position):
+    """Replace several sections in the target in one pass. See --map."""
+    target_content = target.read()
+    result, counts = replace_sections(target_content, sources, discard_markers, create, create_position)
+
+    missing = [section for section, count in counts.items() if count == 0]
+    if missing and not create:
+        click.echo(f"Error: No markers for section(s) {', '.join(missing)} found in target file.", err=True)
+        click.echo(f"Use --create to add markers if this is the first time.", err=True)
+        sys.exit(1)
+    summary = ", ".join(
+        f"{section}: {count} occurrences" if count else f"{section}: created" for section, count in counts.items()
+    )
+
+    if dry_run:
+        click.echo(f"Would update sections ({summary}).")
+        click.echo("New content would be:")
+        click.echo("---")
+        click.echo(result)
+        click.echo("---")
+        return
+
+    if in_place:
+        if write_if_changed(target.name, result):
+            click.echo(f"Updated {target.name} ({summary})", err=True)
+        else:
+            click.echo(f"No changes in {target.name}", err=True)
+    else:
+        output.write(result)
+        if output.name != "<stdout>":
+            click.echo(f"Updated {output.name} ({summary})", err=True)
+
+
 if __name__ == "__main__":
     replace_between()
@@ -6,11 +6,23 @@ which contaminates the JSON. We use json.JSONDecoder.raw_decode, which parses on
 complete JSON value and stops — trailing diagnostic text is ignored.
 
 Reads from stdin, writes a flattened {name: value} JSON object to stdout, omitting
-outputs marked sensitive.
+outputs marked sensitive. The input is read a chunk at a time and outputs are written
+as they are found, so memory use doesn't grow with the total size of the outputs, and
+sensitive values are skipped over without being kept in memory.
 """
 
+import argparse
 import json
+import os
+import re
 import sys
+import uuid
+from pathlib import Path
+from typing import Callable, TextIO
+
+# The streaming JSON reader is shared with the other actions, at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from json_stream import JsonStreamReader  # noqa: E402
 
 
 def extract(raw: str) -> dict:
@@ -21,5 +33,188 @@ def extract(raw: str) -> dict:
     return {k: v["value"] for k, v in obj.items() if not v.get("sensitive", False)}
 
 
+def parse_projection(expression: str) -> tuple[str, list]:
+    """Split a projection like `endpoints.api.urls[0]` into an output name and a path."""
+    if not re.fullmatch(r"[^.\[\]]+(?:\.[^.\[\]]+|\[\d+\])*", expression):
+        raise ValueError(f"invalid output projection: {expression!r}")
+    parts = re.findall(r"\[(\d+)\]|([^.\[\]]+)", expression)
+    return parts[0][1], [int(index) if index else key for index, key in parts[1:]]
+
+
+def project(value, path: list):
+    """Follow a path of keys and list indices into a value. Raises LookupError if it doesn't exist."""
+    for step in path:
+        if isinstance(step, int) and not isinstance(value, list) or isinstance(step, str) and not isinstance(value, dict):
+            raise LookupError(step)
+        value = value[step]
+    return value
+
+
+class ResultWriter:
+    """Writes extracted values as one JSON object, spilling large values to files.
+
+    Values larger than spill_threshold bytes (as JSON) are written to a file in spill_dir
+    instead, and left out of the object. Only up to spill_threshold bytes of a value are
+    buffered while deciding. Keys that map to the same file name get a numbered suffix.
+    """
+
+    def __init__(self, output: TextIO, spill_dir: Path | None = None, spill_threshold: int | None = None):
+        self.output = output
+        self.spill_dir = spill_dir
+        self.spill_threshold = spill_threshold
+        self.separator = "{"
+        self.spilled: dict[str, str] = {}
+        self.spill_names: set[str] = set()
+
+    def add(self, key: str, copy: Callable[[Callable[[str], object]], None]) -> None:
+        """Add a value, written by copy(write)."""
+        if self.spill_threshold is None:
+            self.output.write(self.separator + json.dumps(key) + ": ")
+            self.separator = ", "
+            copy(self.output.write)
+            return
+
+        pieces: list[str] = []
+        size = 0
+        spill_file = None
+
+        def write(piece: str) -> None:
+            nonlocal size, spill_file
+            if spill_file is not None:
+                spill_file.write(piece)
+                return
+            pieces.append(piece)
+            size += len(piece.encode())
+            if size > self.spill_threshold:
+                path = self.spill_dir / self.spill_name(key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                spill_file = open(path, "w")
+                spill_file.writelines(pieces)
+                pieces.clear()
+                self.spilled[key] = str(path)
+
+        copy(write)
+        if spill_file is not None:
+            spill_file.close()
+        else:
+            self.output.write(self.separator + json.dumps(key) + ": " + "".join(pieces))
+            self.separator = ", "
+
+    def spill_name(self, key: str) -> str:
+        """A file name for a spilled value that no other key in this result uses."""
+        base = re.sub(r"[^\w.-]", "_", key)
+        name, counter = base, 1
+        # Compare case-insensitively, for case-insensitive file systems
+        while name.lower() in self.spill_names:
+            counter += 1
+            name = f"{base}-{counter}"
+        self.spill_names.add(name.lower())
+        return name + ".json"
+
+    def close(self) -> None:
+        self.output.write("}" if self.separator == ", " else "{}")
+
+
+def extract_stream(
+    stream: TextIO,
+    output: TextIO,
+    chunk_size: int = 64 * 1024,
+    select: list[str] | None = None,
+    spill_dir: Path | None = None,
+    spill_threshold: int | None = None,
+) -> dict[str, str]:
+    """Streaming version of extract(): writes the same JSON as json.dumps(extract(...)).
+
+    If select is given, only those outputs (or projections into them, like `a.b[0]`) are
+    written, keyed by the selection. Values over spill_threshold bytes are written to
+    files in spill_dir instead. Returns the spilled files, by key.
+    """
+    projections: dict[str, list[tuple[str, list]]] = {}
+    for expression in select or []:
+        name, path = parse_projection(expression)
+        projections.setdefault(name, []).append((expression, path))
+    missing = set(select or [])
+
+    reader = JsonStreamReader(stream, chunk_size)
+    if not reader.seek("{"):
+        raise ValueError("no JSON object found in input")
+
+    result = ResultWriter(output, spill_dir, spill_threshold)
+    # Reading stops at the end of the outputs object, so trailing text is never read
+    for name in reader.iter_object():
+        wanted = select is None or name in projections
+        # Projections (other than the whole output) need the value decoded
+        streamed = select is None or projections.get(name) == [(name, [])]
+        sensitive = None
+        value = ...
+        written = False
+        # Terraform writes "sensitive" before "value", so the value can usually be copied
+        # or skipped right away. Otherwise it's held until sensitivity is known.
+        for field in reader.iter_object():
+            if field == "sensitive":
+                sensitive = reader.read_value()
+            elif field != "value" or not wanted or sensitive:
+                reader.skip_value()
+            elif sensitive is None or not streamed:
+                value = reader.read_value()
+            else:
+                result.add(name, reader.copy_value)
+                missing.discard(name)
+                written = True
+        if not wanted or sensitive or written:
+            continue
+        if value is ...:
+            raise ValueError(f"output {name!r} has no value")
+        for key, path in projections.get(name, [(name, [])]):
+            try:
+                projected = project(value, path)
+            except LookupError:
+                continue
+            result.add(key, lambda write: write(json.dumps(projected)))
+            missing.discard(key)
+    result.close()
+
+    if missing:
+        print(f"Warning: selected outputs not found (or sensitive): {sorted(missing)}", file=sys.stderr)
+    return result.spilled
+
+
+def write_github_output(name: str, write: Callable[[TextIO], object], path: str) -> None:
+    """Append an output to a $GITHUB_OUTPUT file, using the multiline (heredoc) format."""
+    delimiter = f"ghadelimiter_{uuid.uuid4()}"
+    with open(path, "a") as f:
+        f.write(f"{name}<<{delimiter}\n")
+        write(f)
+        f.write(f"\n{delimiter}\n")
+
+
 if __name__ == "__main__":
-    print(json.dumps(extract(sys.stdin.read())))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--select",
+        action="append",
+        help="Output name or projection (e.g. `endpoints.api.urls[0]`) to include. Can be repeated. Default: all",
+    )
+    parser.add_argument(
+        "--github-output",
+        metavar="NAME",
+        help="Write the result to $GITHUB_OUTPUT as NAME (and spilled files as NAME-files) instead of stdout",
+    )
+    parser.add_argument("--spill-dir", type=Path, help="Directory for values over --spill-threshold")
+    parser.add_argument("--spill-threshold", type=int, help="Write values larger than this many bytes to files")
+    args = parser.parse_args()
+    if (args.spill_dir is None) != (args.spill_threshold is None):
+        parser.error("--spill-dir and --spill-threshold must be used together")
+
+    options = {"select": args.select, "spill_dir": args.spill_dir, "spill_threshold": args.spill_threshold}
+    if args.github_output:
+        spilled = {}
+
+        def write_result(f: TextIO) -> None:
+            spilled.update(extract_stream(sys.stdin, f, **options))
+
+        write_github_output(args.github_output, write_result, os.environ["GITHUB_OUTPUT"])
+        write_github_output(f"{args.github_output}-files", lambda f: f.write(json.dumps(spilled)), os.environ["GITHUB_OUTPUT"])
+    else:
+        extract_stream(sys.stdin, sys.stdout, **options)
+        print()
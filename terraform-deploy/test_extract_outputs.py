@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 """Tests for extract_outputs.py. Run with: python3 test_extract_outputs.py"""
 
+import io
 import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
 
-from extract_outputs import extract
+from extract_outputs import extract, extract_stream, parse_projection
 
 
 CLEAN = json.dumps(
@@ -94,6 +100,133 @@ def test_no_json_raises():
     raise AssertionError("expected ValueError")
 
 
+def _extract_stream(raw: str, chunk_size: int = 64 * 1024) -> str:
+    output = io.StringIO()
+    extract_stream(io.StringIO(raw), output, chunk_size)
+    return output.getvalue()
+
+
+def test_stream_matches_extract():
+    # Small chunks split keys, strings and numbers across reads
+    for raw in (CLEAN, TRAILING_WARNING, "{}", "Warning: before\n" + CLEAN):
+        for chunk_size in (1, 5, 64 * 1024):
+            assert _extract_stream(raw, chunk_size) == json.dumps(extract(raw))
+
+
+def test_stream_value_before_sensitive():
+    raw = json.dumps(
+        {
+            "secret": {"value": {"k": "s3cret"}, "sensitive": True},
+            "public": {"value": None, "type": "string", "sensitive": False},
+        }
+    )
+    assert _extract_stream(raw, chunk_size=3) == '{"public": null}'
+
+
+def test_stream_stops_after_outputs():
+    class NoReadsAfterEnd(io.StringIO):
+        def read(self, size=-1):
+            chunk = super().read(size)
+            assert not chunk.startswith("TRAILING"), "read past the end of the outputs"
+            return chunk
+
+    raw = json.dumps({"a": {"sensitive": False, "value": 1}}) + " "
+    output = io.StringIO()
+    extract_stream(NoReadsAfterEnd(raw + "TRAILING" * 1000), output, chunk_size=len(raw))
+    assert output.getvalue() == '{"a": 1}'
+
+
+def test_stream_no_json_raises():
+    try:
+        _extract_stream("just warnings, no json here", chunk_size=4)
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+NESTED = json.dumps(
+    {
+        "endpoints": {
+            "sensitive": False,
+            "value": {"api": {"urls": ["https://a", "https://b"]}, "web": "https://w"},
+        },
+        "secret": {"sensitive": True, "value": {"api": "s3cret"}},
+        "big": {"sensitive": False, "value": ["x" * 100] * 10},
+    }
+)
+
+
+def test_parse_projection():
+    assert parse_projection("endpoints") == ("endpoints", [])
+    assert parse_projection("endpoints.api.urls[1]") == ("endpoints", ["api", "urls", 1])
+    for invalid in ("", ".a", "a.", "a..b", "a[x]", "[0]"):
+        try:
+            parse_projection(invalid)
+        except ValueError:
+            continue
+        raise AssertionError(f"expected ValueError for {invalid!r}")
+
+
+def test_stream_select_and_project():
+    output = io.StringIO()
+    extract_stream(
+        io.StringIO(NESTED),
+        output,
+        chunk_size=7,
+        select=["endpoints.api.urls[1]", "endpoints.web", "secret.api", "missing", "endpoints.nope"],
+    )
+    assert json.loads(output.getvalue()) == {
+        "endpoints.api.urls[1]": "https://b",
+        "endpoints.web": "https://w",
+    }
+
+
+def test_stream_spills_large_values():
+    with tempfile.TemporaryDirectory() as tmp:
+        output = io.StringIO()
+        spilled = extract_stream(io.StringIO(NESTED), output, chunk_size=16, spill_dir=Path(tmp), spill_threshold=200)
+
+        assert json.loads(output.getvalue()) == {"endpoints": json.loads(NESTED)["endpoints"]["value"]}
+        assert spilled == {"big": os.path.join(tmp, "big.json")}
+        assert json.loads(Path(spilled["big"]).read_text()) == ["x" * 100] * 10
+
+
+def test_stream_spills_colliding_keys_to_separate_files():
+    values = {"a.b": ["one"] * 10, "a/b": ["two"] * 10, "a_b": ["three"] * 10, "A_B": ["four"] * 10}
+    raw = json.dumps({key: {"sensitive": False, "value": value} for key, value in values.items()})
+    with tempfile.TemporaryDirectory() as tmp:
+        spilled = extract_stream(io.StringIO(raw), io.StringIO(), spill_dir=Path(tmp), spill_threshold=10)
+
+        assert spilled == {
+            "a.b": os.path.join(tmp, "a.b.json"),
+            "a/b": os.path.join(tmp, "a_b.json"),
+            "a_b": os.path.join(tmp, "a_b-2.json"),
+            "A_B": os.path.join(tmp, "A_B-3.json"),
+        }
+        for key, value in values.items():
+            assert json.loads(Path(spilled[key]).read_text()) == value
+
+
+def test_github_output_heredoc():
+    with tempfile.TemporaryDirectory() as tmp:
+        github_output = Path(tmp, "output")
+        subprocess.run(
+            [sys.executable, "extract_outputs.py", "--github-output", "result", "--select", "endpoints.web"],
+            input=NESTED,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, "GITHUB_OUTPUT": str(github_output)},
+        )
+        lines = github_output.read_text().splitlines()
+
+        assert lines[0].startswith("result<<ghadelimiter_")
+        assert lines[1] == '{"endpoints.web": "https://w"}'
+        assert lines[2] == lines[0].split("<<")[1]
+        assert lines[3].startswith("result-files<<")
+        assert lines[4] == "{}"
+
+
 if __name__ == "__main__":
     tests = [v for k, v in globals().items() if k.startswith("test_") and callable(v)]
     for t in tests:
@@ -0,0 +1,83 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pytablewriter
+
+import action_to_md
+from action_to_md import MANIFEST_FILE, generate_table, render, update_all_readmes
+
+ROOT = Path(__file__).parent
+
+
+def pytablewriter_table(headers, rows):
+    return pytablewriter.MarkdownTableWriter(headers=headers, value_matrix=rows).dumps()
+
+
+class TestGenerateTable(unittest.TestCase):
+    def test_matches_pytablewriter_for_repository_actions(self):
+        # The built-in renderer must not change any generated README
+        action_files = sorted(ROOT.glob("*/action.yml"))
+        self.assertTrue(action_files)
+        for config_file in action_files:
+            with self.subTest(action=config_file.parent.name):
+                with mock.patch.object(action_to_md, "generate_table", pytablewriter_table):
+                    expected_markdown = render(config_file, "main")
+                self.assertEqual(render(config_file, "main"), expected_markdown)
+
+    def test_matches_pytablewriter(self):
+        headers = ["Name", "Description", "Default"]
+        cases = [
+            [["`a`", "Plain text", "``n/a``"]],
+            [["`b`", "Pipes | and `code|with|pipes`", "``{\"a\": [1, 2]}``"]],
+            [["`c`", "Line\nbreaks\r\nand\ttabs", "````"]],
+            [["`d`", "'Quoted'", '"also quoted"']],
+            [["`e`", "Wide 漢字 and ünïcödé", "``x``"]],
+            # Typed cells fall back to pytablewriter itself
+            [["`f`", "42", "true"]],
+        ]
+        for rows in cases:
+            with self.subTest(rows=rows):
+                self.assertEqual(generate_table(headers, rows), pytablewriter_table(headers, rows))
+
+
+class TestManifest(unittest.TestCase):
+    def test_removed_actions_are_pruned(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for action in ("one", "two"):
+                (root / action).mkdir()
+                (root / action / "action.yml").write_text(f"name: {action}\nruns:\n  using: composite\n  steps: []\n")
+                (root / action / "README.md").write_text("")
+            manifest_path = root / MANIFEST_FILE
+
+            update_all_readmes(root, "main", jobs=1, manifest_path=manifest_path)
+            self.assertEqual(sorted(json.loads(manifest_path.read_text())), ["one/action.yml", "two/action.yml"])
+
+            (root / "two/action.yml").unlink()
+            results = update_all_readmes(root, "main", jobs=1, manifest_path=manifest_path)
+            self.assertEqual(results, [(root / "one/README.md", None)])
+            self.assertEqual(sorted(json.loads(manifest_path.read_text())), ["one/action.yml"])
+
+    def test_force_updates_every_readme_and_writes_the_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "one").mkdir()
+            (root / "one/action.yml").write_text("name: one\nruns:\n  using: composite\n  steps: []\n")
+            (root / "one/README.md").write_text("")
+            manifest_path = root / MANIFEST_FILE
+            update_all_readmes(root, "main", jobs=1, manifest_path=manifest_path)
+
+            manifest_path.write_text("{}")
+            results = update_all_readmes(root, "main", jobs=1, manifest_path=manifest_path, force=True)
+            self.assertIsNotNone(results[0][1])
+            self.assertEqual(list(json.loads(manifest_path.read_text())), ["one/action.yml"])
+
+            results = update_all_readmes(root, "main", jobs=1, manifest_path=manifest_path)
+            self.assertEqual(results, [(root / "one/README.md", None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
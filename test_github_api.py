@@ -0,0 +1,284 @@
+import contextlib
+import http.server
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from github_api import GitHubAPIError, GitHubClient, select
+
+
+class _StubServer:
+    """Local HTTP/1.1 server standing in for the GitHub API.
+
+    Responses are taken from `routes` (path -> list of (status, headers, body)), the last
+    one repeating. Requests are recorded with their headers and the client port, so tests
+    can tell which connection they came in on.
+    """
+
+    def __init__(self):
+        self.routes: dict[str, list[tuple[int, dict, object]]] = {}
+        self.requests: list[dict] = []
+        self.delay = 0.0
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.requests.append({"path": self.path, "headers": dict(self.headers), "port": self.client_address[1]})
+                time.sleep(stub.delay)
+                responses = stub.routes.get(self.path, [(404, {}, {"message": "Not Found"})])
+                status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+                if status == 200 and "ETag" in headers and self.headers.get("If-None-Match") == headers["ETag"]:
+                    status, body = 304, None
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestGitHubClient(unittest.TestCase):
+    def setUp(self):
+        self.stub = _StubServer()
+        self.addCleanup(self.stub.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = Path(tmp.name)
+        self.sleeps: list[float] = []
+
+    def client(self, **kwargs) -> GitHubClient:
+        kwargs = {"token": "t0ken", "base_url": self.stub.url, "sleep": self.sleeps.append, **kwargs}
+        client = GitHubClient(**kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_get_sends_token_and_decodes_json(self):
+        self.stub.routes["/repos/o/r/commits/abc"] = [(200, {}, {"sha": "abc"})]
+
+        self.assertEqual(self.client().get("repos/o/r/commits/abc"), {"sha": "abc"})
+        headers = self.stub.requests[0]["headers"]
+        self.assertEqual(headers["Authorization"], "Bearer t0ken")
+        self.assertEqual(headers["Accept"], "application/vnd.github+json")
+
+    def test_base_url_path_prefix(self):
+        self.stub.routes["/api/v3/repos/o/r"] = [(200, {}, {"name": "r"})]
+        self.assertEqual(self.client(base_url=f"{self.stub.url}/api/v3/").get("/repos/o/r"), {"name": "r"})
+
+    def test_connections_are_reused(self):
+        for i in range(5):
+            self.stub.routes[f"/runs/{i}"] = [(200, {}, {"id": i})]
+
+        client = self.client()
+        self.assertEqual([client.get(f"runs/{i}") for i in range(5)], [{"id": i} for i in range(5)])
+        self.assertEqual(len({request["port"] for request in self.stub.requests}), 1)
+
+    def test_identical_requests_are_merged(self):
+        self.stub.routes["/runs/1"] = [(200, {}, {"id": 1})]
+        self.stub.routes["/runs/2"] = [(200, {}, {"id": 2})]
+        self.stub.delay = 0.05
+
+        client = self.client()
+        results = client.get_many(["runs/1", "runs/2", "runs/1", "runs/1"])
+        self.assertEqual(results, [{"id": 1}, {"id": 2}, {"id": 1}, {"id": 1}])
+        self.assertEqual(client.get("runs/1"), {"id": 1})
+        self.assertEqual(sorted(request["path"] for request in self.stub.requests), ["/runs/1", "/runs/2"])
+
+    def test_failed_requests_are_not_merged(self):
+        self.stub.routes["/runs/1"] = [(404, {}, {"message": "Not Found"}), (200, {}, {"id": 1})]
+
+        client = self.client()
+        with self.assertRaises(GitHubAPIError) as error:
+            client.get("runs/1")
+        self.assertEqual(error.exception.status, 404)
+        self.assertEqual(client.get("runs/1"), {"id": 1})
+
+    def test_etag_revalidation(self):
+        self.stub.routes["/repos/o/r/commits/HEAD"] = [(200, {"ETag": '"v1"'}, {"sha": "abc"})]
+
+        self.assertEqual(self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/HEAD"), {"sha": "abc"})
+        self.assertEqual(self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/HEAD"), {"sha": "abc"})
+
+        self.assertNotIn("If-None-Match", self.stub.requests[0]["headers"])
+        self.assertEqual(self.stub.requests[1]["headers"]["If-None-Match"], '"v1"')
+
+    def test_changed_response_replaces_cache(self):
+        self.stub.routes["/repos/o/r/commits/HEAD"] = [(200, {"ETag": '"v1"'}, {"sha": "abc"})]
+        self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/HEAD")
+
+        self.stub.routes["/repos/o/r/commits/HEAD"] = [(200, {"ETag": '"v2"'}, {"sha": "def"})]
+        self.assertEqual(self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/HEAD"), {"sha": "def"})
+        self.assertEqual(self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/HEAD"), {"sha": "def"})
+        self.assertEqual(self.stub.requests[2]["headers"]["If-None-Match"], '"v2"')
+
+    def test_max_age_skips_request(self):
+        self.stub.routes["/repos/o/r/commits/abc"] = [(200, {"ETag": '"v1"'}, {"sha": "abc"})]
+
+        self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/abc", max_age=60)
+        self.client(cache_dir=self.cache_dir).get("repos/o/r/commits/abc", max_age=60)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_cache_is_keyed_by_token(self):
+        self.stub.routes["/repos/o/r"] = [(200, {"ETag": '"v1"'}, {"name": "r"})]
+
+        self.client(cache_dir=self.cache_dir).get("repos/o/r", max_age=60)
+        self.client(cache_dir=self.cache_dir, token="other").get("repos/o/r", max_age=60)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_rate_limit_waits_for_reset(self):
+        reset = str(int(time.time()) + 5)
+        self.stub.routes["/repos/o/r"] = [
+            (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}, {"message": "API rate limit exceeded"}),
+            (429, {"Retry-After": "2"}, {"message": "You have exceeded a secondary rate limit"}),
+            (200, {}, {"name": "r"}),
+        ]
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.client().get("repos/o/r"), {"name": "r"})
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(4 <= self.sleeps[0] <= 7)
+        self.assertEqual(self.sleeps[1], 2)
+
+    def test_rate_limit_longer_than_max_wait_fails(self):
+        reset = str(int(time.time()) + 3600)
+        self.stub.routes["/repos/o/r"] = [
+            (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}, {"message": "API rate limit exceeded"}),
+        ]
+
+        with self.assertRaises(GitHubAPIError) as error:
+            self.client().get("repos/o/r")
+        self.assertIn("API rate limit exceeded", str(error.exception))
+        self.assertEqual(self.sleeps, [])
+
+    def test_server_errors_are_retried_with_backoff(self):
+        self.stub.routes["/repos/o/r"] = [(502, {}, {"message": "Bad Gateway"})] * 2 + [(200, {}, {"name": "r"})]
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.client().get("repos/o/r"), {"name": "r"})
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLess(self.sleeps[0], self.sleeps[1] * 2)
+
+    def test_server_errors_give_up_after_max_retries(self):
+        self.stub.routes["/repos/o/r"] = [(500, {}, {"message": "Internal Server Error"})]
+
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(GitHubAPIError):
+            self.client(max_retries=2).get("repos/o/r")
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_permission_errors_are_not_retried(self):
+        self.stub.routes["/repos/o/r"] = [(403, {}, {"message": "Resource not accessible by integration"})]
+
+        with self.assertRaises(GitHubAPIError):
+            self.client().get("repos/o/r")
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def paginated_jobs(self, pages: int) -> None:
+        for page in range(1, pages + 1):
+            headers = {"ETag": f'"p{page}"'}
+            if page < pages:
+                headers["Link"] = (
+                    f'<{self.stub.url}/runs/1/jobs?per_page=2&page={page + 1}>; rel="next", '
+                    f'<{self.stub.url}/runs/1/jobs?per_page=2&page={pages}>; rel="last"'
+                )
+            path = "/runs/1/jobs?per_page=2" + (f"&page={page}" if page > 1 else "")
+            jobs = [{"id": 2 * page - 1}, {"id": 2 * page}]
+            self.stub.routes[path] = [(200, headers, {"total_count": 2 * pages, "jobs": jobs})]
+
+    def test_get_all_follows_next_links(self):
+        self.paginated_jobs(3)
+
+        client = self.client()
+        result = client.get_all("runs/1/jobs?per_page=2")
+        self.assertEqual(result, {"total_count": 6, "jobs": [{"id": i} for i in range(1, 7)]})
+        # The cached first page isn't changed by merging
+        self.assertEqual(len(client.get("runs/1/jobs?per_page=2")["jobs"]), 2)
+
+    def test_get_all_concatenates_lists(self):
+        self.stub.routes["/items"] = [(200, {"Link": f'<{self.stub.url}/items?page=2>; rel="next"'}, [1, 2])]
+        self.stub.routes["/items?page=2"] = [(200, {}, [3])]
+        self.assertEqual(self.client().get_all("items"), [1, 2, 3])
+
+    def test_get_all_follows_cached_next_links(self):
+        self.paginated_jobs(2)
+
+        self.client(cache_dir=self.cache_dir).get_all("runs/1/jobs?per_page=2")
+        result = self.client(cache_dir=self.cache_dir).get_all("runs/1/jobs?per_page=2")
+        self.assertEqual(result["jobs"], [{"id": i} for i in range(1, 5)])
+        self.assertEqual(self.stub.requests[3]["headers"]["If-None-Match"], '"p2"')
+
+
+class TestSelect(unittest.TestCase):
+    def test_select(self):
+        value = {"commit": {"message": "m"}, "jobs": [{"name": "a"}, {"name": "b"}], "author": None}
+        self.assertEqual(select(value, "commit.message"), "m")
+        self.assertEqual(select(value, "jobs[1].name"), "b")
+        self.assertIsNone(select(value, "author.login"))
+        self.assertIsNone(select(value, "jobs[5].name"))
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.stub = _StubServer()
+        self.addCleanup(self.stub.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = tmp.name
+
+    def run_cli(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, str(Path(__file__).with_name("github_api.py")), "--cache-dir", self.cache_dir, *args],
+            capture_output=True,
+            text=True,
+            env={"GITHUB_API_URL": self.stub.url, "GH_TOKEN": "t0ken", "PATH": ""},
+        )
+
+    def test_select_prints_strings_as_is(self):
+        self.stub.routes["/repos/o/r/commits/abc"] = [(200, {}, {"commit": {"message": "Line 1\n\nLine 2"}})]
+
+        result = self.run_cli("repos/o/r/commits/abc", "--select", "commit.message")
+        self.assertEqual(result.stdout, "Line 1\n\nLine 2\n")
+
+    def test_several_paths_print_json_lines(self):
+        self.stub.routes["/runs/1"] = [(200, {}, {"id": 1, "name": "a\nb"})]
+        self.stub.routes["/runs/2"] = [(200, {}, {"id": 2, "name": "c"})]
+
+        result = self.run_cli("runs/2", "runs/1", "--select", "name")
+        self.assertEqual(result.stdout.splitlines(), ['"c"', '"a\\nb"'])
+
+    def test_paginate(self):
+        self.stub.routes["/runs/1/jobs"] = [
+            (200, {"Link": f'<{self.stub.url}/runs/1/jobs?page=2>; rel="next"'}, {"jobs": [{"id": 1}]})
+        ]
+        self.stub.routes["/runs/1/jobs?page=2"] = [(200, {}, {"jobs": [{"id": 2}]})]
+
+        self.assertEqual(self.run_cli("runs/1/jobs", "--select", "jobs").stdout, '[{"id": 1}]\n')
+        result = self.run_cli("runs/1/jobs", "--select", "jobs", "--paginate")
+        self.assertEqual(result.stdout, '[{"id": 1}, {"id": 2}]\n')
+
+    def test_errors_exit_non_zero(self):
+        result = self.run_cli("repos/o/missing")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("GitHub API error 404: Not Found", result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import io
+import json
+import unittest
+
+from json_stream import INCOMPLETE, JsonStreamReader
+
+DOCUMENT = {
+    "text": 'quotes " and \\ backslashes \\" and brackets }]',
+    "numbers": [0, -12.5e3, 123456789012345678901234567890],
+    "nested": {"empty": {}, "list": [], "deep": [[{"a": [None, True, False]}]]},
+    "unicode": "æøå ☃",
+}
+
+
+def reader(document: object, chunk_size: int) -> JsonStreamReader:
+    return JsonStreamReader(io.StringIO(json.dumps(document, indent=1)), chunk_size)
+
+
+class TestJsonStreamReader(unittest.TestCase):
+    def test_walk_and_read_values(self):
+        # Small chunks split keys, strings, numbers and escapes across reads
+        for chunk_size in (1, 2, 7, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                r = reader(DOCUMENT, chunk_size)
+                values = {key: r.read_value() for key in r.iter_object()}
+                self.assertEqual(values, DOCUMENT)
+
+    def test_iter_array(self):
+        r = reader([1, [2], {"x": 3}], 1)
+        self.assertEqual([r.read_value() for _ in r.iter_array()], [1, [2], {"x": 3}])
+
+    def test_skip_value(self):
+        for chunk_size in (1, 3, 16, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                r = reader({**DOCUMENT, "last": 1}, chunk_size)
+                for key in r.iter_object():
+                    if key == "last":
+                        self.assertEqual(r.read_value(), 1)
+                    else:
+                        r.skip_value()
+
+    def test_read_buffered(self):
+        r = JsonStreamReader(io.StringIO('[{"a": 1}, {"b": [2, 3]}]'), chunk_size=12)
+        r.fill()
+        r.expect("[")
+        self.assertEqual(r.read_buffered(), {"a": 1})
+        r.expect(",")
+        self.assertIs(r.read_buffered(), INCOMPLETE)
+        self.assertEqual(r.read_value(), {"b": [2, 3]})
+
+    def test_copy_value(self):
+        for chunk_size in (1, 5, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                output = io.StringIO()
+                reader(DOCUMENT, chunk_size).copy_value(output.write)
+                self.assertEqual(output.getvalue(), json.dumps(DOCUMENT))
+
+    def test_seek(self):
+        r = JsonStreamReader(io.StringIO('Warning: x\n{"a": 1}'), chunk_size=3)
+        self.assertTrue(r.seek("{"))
+        self.assertEqual(r.read_value(), {"a": 1})
+        self.assertFalse(JsonStreamReader(io.StringIO("no json"), chunk_size=3).seek("{"))
+
+    def test_nothing_is_read_after_the_document(self):
+        class NoReadsAfterEnd(io.StringIO):
+            def read(self, size=-1):
+                chunk = super().read(size)
+                assert not chunk.startswith("TRAILING"), "read past the end of the document"
+                return chunk
+
+        text = json.dumps({"a": [1, 2], "b": "c"}) + " "
+        r = JsonStreamReader(NoReadsAfterEnd(text + "TRAILING"), chunk_size=len(text))
+        for _ in r.iter_object():
+            r.skip_value()
+
+    def test_invalid_documents_raise(self):
+        for text in ('{"a": ', '{"a": [1, 2', '{"a" 1}', '{1: 2}', '["unterminated'):
+            with self.subTest(text=text):
+                r = JsonStreamReader(io.StringIO(text), chunk_size=2)
+                with self.assertRaises(ValueError):
+                    for _ in r.iter_object() if text.startswith("{") else r.iter_array():
+                        r.skip_value()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import random
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+
+from replace_between import replace_section, replace_sections, section_markers, write_if_changed
+
+
+def replace_one_by_one(content, sources, **options):
+    counts = {}
+    for section, source in sources.items():
+        content, counts[section] = replace_section(content, source, *section_markers(section), **options)
+    return content, counts
+
+
+class TestReplaceSections(unittest.TestCase):
+    README = (
+        "# Title\n\n"
+        "<!-- USAGE BEGIN -->\nold usage\n<!-- USAGE END -->\n\n"
+        "Text in between\n\n"
+        "<!-- API BEGIN -->\nold api\n<!-- API END -->\n"
+        "<!-- USAGE BEGIN -->\nsecond usage\n<!-- USAGE END -->\n"
+    )
+    SOURCES = {"API": "new api\n| a | b |", "USAGE": "new usage", "MISSING": "created"}
+
+    def test_matches_replace_section(self):
+        for options in ({}, {"discard_markers": True}, {"create": True}, {"create": True, "create_position": "prepend"}):
+            with self.subTest(options=options):
+                self.assertEqual(
+                    replace_sections(self.README, self.SOURCES, **options),
+                    replace_one_by_one(self.README, self.SOURCES, **options),
+                )
+
+    def test_matches_replace_section_on_generated_documents(self):
+        # Well-formed documents: sections don't overlap or nest, and every begin marker has an end marker
+        rng = random.Random(0)
+        sections = ["A", "B", "C"]
+        for _ in range(500):
+            parts = []
+            for _ in range(rng.randrange(6)):
+                section = rng.choice(sections)
+                start, end = section_markers(section)
+                parts.append(rng.choice(["", "text\n", "\n\n", "<!-- comment -->"]))
+                parts.append(f"{start}{rng.choice(['', 'x', chr(10) + 'old' + chr(10)])}{end}")
+            content = "".join(parts)
+            sources = {section: f"new {section}" for section in rng.sample(sections, rng.randrange(1, 4))}
+            self.assertEqual(replace_sections(content, sources), replace_one_by_one(content, sources), content)
+
+    def test_unterminated_section_is_left_alone(self):
+        content = "<!-- API BEGIN -->\nno end\n"
+        self.assertEqual(replace_sections(content, {"API": "new"}), (content, {"API": 0}))
+
+
+class TestWriteIfChanged(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "README.md"
+
+    def test_keeps_file_mode(self):
+        self.path.write_text("old")
+        self.path.chmod(0o640)
+
+        self.assertTrue(write_if_changed(str(self.path), "new"))
+        self.assertEqual(self.path.read_text(), "new")
+        self.assertEqual(stat.S_IMODE(self.path.stat().st_mode), 0o640)
+
+    def test_skips_unchanged_file(self):
+        self.path.write_text("same")
+        os.utime(self.path, (0, 0))
+        inode = self.path.stat().st_ino
+
+        self.assertFalse(write_if_changed(str(self.path), "same"))
+        self.assertEqual(self.path.stat().st_mtime, 0)
+        self.assertEqual(self.path.stat().st_ino, inode)
+
+    def test_creates_missing_file(self):
+        self.assertTrue(write_if_changed(str(self.path), "new"))
+        self.assertEqual(self.path.read_text(), "new")
+        self.assertEqual(list(self.path.parent.iterdir()), [self.path])
+
+
+if __name__ == "__main__":
+    unittest.main()